@@ -0,0 +1,161 @@
+import filecmp
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+from .evaluate import longest_common_substring_len
+from .extract import extract
+from .match import match
+from .synthetic import generate_corpus
+from .utils import dumps_json
+
+
+def compare_join(standard, extract_path, filenames, result_path):
+    # run match() with the nested scan and the hash join, the CSVs of both runs must be identical
+    timings = {}
+    for join in ['nested', 'hash']:
+        join_path = os.path.join(result_path, join)
+        os.makedirs(join_path, exist_ok=True)
+        start_time = time.perf_counter()
+        match(standard, extract_path, filenames, join_path, join=join)
+        timings[join] = time.perf_counter() - start_time
+        logger.info(f'[JoinTime]: {standard}||{join}||{timings[join]:.3f}s')
+
+    nested_path, hash_path = os.path.join(result_path, 'nested'), os.path.join(result_path, 'hash')
+    csv_files = sorted(f for f in os.listdir(nested_path) if f.startswith(standard) and f.endswith('.csv'))
+    _, mismatch, errors = filecmp.cmpfiles(nested_path, hash_path, csv_files, shallow=False)
+    for f in mismatch + errors:
+        logger.error(f'[DiffRows]: {standard}||{f}')
+    if not mismatch and not errors:
+        logger.success(f'[SameRows]: {standard}||{len(csv_files)} files||speedup {timings["nested"] / max(timings["hash"], 1e-9):.1f}x')
+    return timings, mismatch + errors
+
+
+def lcs_table_len(str1, str2):
+    # the former full-table longest common substring of evaluate.py, the reference of compare_lcs
+    dp = [[0] * (len(str2) + 1) for _ in range(len(str1) + 1)]
+    longest_len = 0
+    for i in range(1, len(str1) + 1):
+        for j in range(1, len(str2) + 1):
+            if str1[i-1] == str2[j-1]:
+                dp[i][j] = dp[i-1][j-1] + 1
+                longest_len = max(longest_len, dp[i][j])
+    return longest_len
+
+
+def random_locator(rng):
+    # a purl, downloadLocation or cpe of realistic length, built from a small alphabet so that pairs share substrings
+    name = ''.join(rng.choice('abcdefgh-_') for _ in range(rng.randint(1, 30)))
+    version = '.'.join(str(rng.randint(0, 20)) for _ in range(rng.randint(1, 4)))
+    kind = rng.randrange(4)
+    if kind == 0:
+        return f'pkg:{rng.choice(["pypi", "maven", "npm", "golang"])}/{name}@{version}'
+    if kind == 1:
+        return f'git+https://github.com/{name[::-1]}/{name}.git@{version}'
+    if kind == 2:
+        return f'cpe:2.3:a:{name}:{name}:{version}:*:*:*:*:*:*:*'
+    return ''.join(rng.choice(string.ascii_lowercase[:4]) for _ in range(rng.randint(0, 300)))
+
+
+def compare_lcs(pairs=5000, seed=0):
+    # longest_common_substring_len against the full table on random pairs, then the time of both on the pairs
+    rng = random.Random(seed)
+    cases = [(random_locator(rng), random_locator(rng)) for _ in range(pairs)]
+    cases += [(a, a[rng.randrange(len(a) + 1):] + b) for a, b in cases[:pairs // 4]]  # long shared runs
+    diffs = [(a, b) for a, b in cases if longest_common_substring_len(a, b) != lcs_table_len(a, b)]
+    for a, b in diffs[:10]:
+        logger.error(f'[DiffLCS]: {a}||{b}')
+    timings = {}
+    for func in [lcs_table_len, longest_common_substring_len]:
+        start_time = time.perf_counter()
+        for a, b in cases:
+            func(a, b)
+        timings[func.__name__] = time.perf_counter() - start_time
+        logger.info(f'[LCSTime]: {func.__name__}||{len(cases)} pairs||{timings[func.__name__]:.3f}s')
+    if not diffs:
+        logger.success(f'[SameLCS]: {len(cases)} pairs||speedup '
+                       f'{timings["lcs_table_len"] / max(timings["longest_common_substring_len"], 1e-9):.1f}x')
+    return timings, diffs
+
+
+# packages (and files) per document of the scaling runs, and the baseline they are held against
+SCALING_SIZES = [100, 400, 1600]
+SCALING_BASELINE = 'results/benchmark/scaling-baseline.json'
+
+
+def scaling_run(task):
+    # extract and match one synthetic corpus, in a fresh process so that the peak RSS is its own
+    work_path, size, repos = task
+    raw_path, extract_path, match_path = [os.path.join(work_path, f'{d}-{size}') for d in ['raw', 'extracted', 'matched']]
+    for path in [extract_path, match_path]:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    names, filenames = generate_corpus(raw_path, repos=repos, packages=size, files=size, seed=size)
+    input_mb = sum(os.path.getsize(os.path.join(raw_path, f)) for f in os.listdir(raw_path)) / 1024 ** 2
+    start_time = time.perf_counter()
+    extract(filenames, raw_path, extract_path)
+    extract_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    for standard in ['cdx', 'spdx']:
+        match(standard, extract_path, names, match_path)
+    match_time = time.perf_counter() - start_time
+    return {'size': size, 'repos': repos, 'input_mb': round(input_mb, 3),
+            'extract_s': round(extract_time, 4), 'extract_mb_s': round(input_mb / max(extract_time, 1e-9), 3),
+            'match_s': round(match_time, 4), 'repos_s': round(repos / max(match_time, 1e-9), 3),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def scaling(work_path='results/benchmark/scaling', sizes=SCALING_SIZES, repos=4, baseline=SCALING_BASELINE,
+            tolerance=1.5, save=False):
+    # time extract and match over growing synthetic corpora, offline. Logged per size:
+    #   [Scaling]:         throughput and peak memory
+    #   [ScalingExponent]: k of time ~ size^k between two sizes, about 1 for linear and 2 for quadratic stages
+    #   [ScalingRegression]: a time or the peak memory over tolerance x the baseline of that size
+    # save: store the results as the new baseline
+    results = []
+    for size in sizes:
+        with ProcessPoolExecutor(1) as executor:
+            result = executor.submit(scaling_run, (work_path, size, repos)).result()
+        logger.info(f'[Scaling]: {size} packages x {repos} repos||extract {result["extract_s"]}s '
+                    f'({result["extract_mb_s"]} MB/s)||match {result["match_s"]}s ({result["repos_s"]} repos/s)||'
+                    f'peak {result["peak_rss_mb"]} MB')
+        if results:
+            previous = results[-1]
+            for key in ['extract_s', 'match_s']:
+                exponent = math.log(max(result[key], 1e-9) / max(previous[key], 1e-9)) / math.log(size / previous['size'])
+                logger.info(f'[ScalingExponent]: {key}||{previous["size"]}->{size}||{exponent:.2f}')
+        results.append(result)
+
+    if baseline and os.path.exists(baseline) and not save:
+        with open(baseline) as f:
+            reference = {r['size']: r for r in json.load(f)}
+        for result in results:
+            base = reference.get(result['size'])
+            if base is None:
+                continue
+            for key in ['extract_s', 'match_s', 'peak_rss_mb']:
+                if result[key] > base[key] * tolerance:
+                    logger.error(f'[ScalingRegression]: {result["size"]}||{key}||{result[key]} > {tolerance} x {base[key]}')
+    if save:
+        os.makedirs(os.path.dirname(baseline), exist_ok=True)
+        with open(baseline, 'w') as f:
+            f.write(dumps_json(results))
+        logger.info(f'[ScalingBaseline]: {baseline}')
+    return results
+
+
+if __name__ == '__main__':
+    extract_path = 'results/extracted'
+    filenames = 'test-sboms-names.txt'
+    result_path = 'results/benchmark'
+
+    for standard in ['cdx', 'spdx']:
+        compare_join(standard, extract_path, filenames, result_path)
+    compare_lcs()
+    scaling()
@@ -1,7 +1,22 @@
 import math
+import time
+from collections import OrderedDict
 from Levenshtein import jaro
 from urllib.parse import unquote
 from loguru import logger
+from .metrics import stage
+from .utils import item_event
+
+# optional batch backends: the sentinel masks need numpy, the batch Jaro of rapidfuzz (installed with Levenshtein) needs both
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from rapidfuzz.distance import Jaro
+    from rapidfuzz.process import cpdist
+except ImportError:
+    cpdist = None
 
 
 def check_empty(v):
@@ -30,32 +45,62 @@ def longest_common_substring_consistency_score(str1, str2):
         return 0.
     if str1 == str2:
         return 1.
+    return substring_similarity(str1, str2)
+
+
+def substring_similarity(str1, str2):
+    # the score of longest_common_substring_consistency_score past its -1/0/1 rules
     if type(str1) != str or type(str2) != str:
         logger.error(f'Invalid string: {str1}||{str2}')
 
     # fix encoding problem
     str1, str2 = unquote(str1), unquote(str2)
-    dp = [[0] * (len(str2) + 1) for _ in range(len(str1) + 1)]
-    longest_len = 0
-    end_pos = 0
-
-    # Build the dp table and find the longest length
-    for i in range(1, len(str1) + 1):
-        for j in range(1, len(str2) + 1):
-            if str1[i-1] == str2[j-1]:
-                dp[i][j] = dp[i-1][j-1] + 1
-                if dp[i][j] > longest_len:
-                    longest_len = dp[i][j]
-                    end_pos = i
-            else:
-                dp[i][j] = 0
-
-    # Extract the longest common substring
-    # longest_common_substr = str1[end_pos-longest_len:end_pos]
+    longest_len = longest_common_substring_len(str1, str2)
     consistency_score = longest_len / max(len(str1), len(str2)) if max(len(str1), len(str2)) else 0.
     return consistency_score
 
 
+def longest_common_substring_len(str1, str2):
+    # length of the longest common substring, in O(min(n, m)) memory:
+    # walk the shorter string and grow the best length by one while the window of best + 1 characters
+    # ending at the current position occurs in the longer one. The window is a suffix of any longer common
+    # substring ending there, so the best length is never missed, and the loop does at most
+    # len(shorter) + best substring searches, which run in C
+    if len(str1) > len(str2):
+        str1, str2 = str2, str1
+    longest_len = 0
+    for i in range(len(str1)):
+        while longest_len <= i and str1[i - longest_len:i + 1] in str2:
+            longest_len += 1
+        if longest_len == len(str1):  # nothing longer left
+            break
+    return longest_len
+
+
+# characters of version ranges and suffixes, reported as [SpecialChar] item events
+SPECIAL_CHARS = ['<', '>', '=', '+', ',', '~', '!', '-']
+
+
+def version_special_char(version1, version2):
+    # the [SpecialChar] item event of version_consistency for a pair, apart from the score so that
+    # ScoreCache hits report it as well: only pairs that get past the empty / equal rules are looked at
+    if check_empty(version1) or check_empty(version2) or version1 in ('NE', '') or version2 in ('NE', ''):
+        return
+    version1, version2 = version1.strip().replace(' ', ''), version2.strip().replace(' ', '')
+    if version1.startswith('v') or version1.startswith('V'):
+        version1 = version1[1:]
+    if version2.startswith('v') or version2.startswith('V'):
+        version2 = version2[1:]
+    if version1 != version2:
+        special_char_event(version1, version2)
+
+
+def special_char_event(version1, version2):
+    # version1 / version2 stripped as in version_consistency
+    if any(sp in version1 or sp in version2 for sp in SPECIAL_CHARS):
+        item_event('SpecialChar', 'INFO', version1, version2)
+
+
 def version_consistency(version1, version2):
     # global SpecialChar, fileinvalid, varchar, backspace, VersionNotMatch, NoneOrEmpty, ManualVersion
     if check_empty(version1) and check_empty(version2):
@@ -83,11 +128,7 @@ def version_consistency(version1, version2):
     # manually defined version as some tools need to be manually filled
     # if '15.4.6' in version1 or '15.4.6' in version2:
     #     logger.info(f'[ManualDefinedVersion]: {version1}||{version2}')
-    special = ['<', '>', '=', '+', ',', '~', '!', '-']
-    for sp in special:
-        if sp in version1 or sp in version2:
-            logger.info(f'[SpecialChar]: {version1}||{version2}')
-            break
+    special_char_event(version1, version2)
 
     # SemVer deal procedure
     v1_parts = version1.split('.')
@@ -117,13 +158,215 @@ def version_consistency(version1, version2):
     return sum(diffs)
 
 
-def text_consistency(text1, text2):
-    # for unstructured text like author, originator, supplier, copyright, etc.
+def text_sentinel(text1, text2):
+    # the score of text_consistency when it needs no similarity, otherwise None
     if check_empty(text1) and check_empty(text2) or text1 == '' and text2 == '':
         return -1
     if text1 == 'NE' or text2 == 'NE' or check_empty(text1) or check_empty(text2):
         return 0.
-    else:
-        if text1 == text2:
-            return 1.
+    if text1 == text2:
+        return 1.
+    return None
+
+
+def text_consistency(text1, text2):
+    # for unstructured text like author, originator, supplier, copyright, etc.
+    score = text_sentinel(text1, text2)
+    if score is None:
         return jaro(unquote(text1), unquote(text2))
+    return score
+
+
+def jaro_batch(strs1, strs2):
+    # jaro of aligned pairs in one C call when rapidfuzz can batch, the same floats as pair by pair
+    if cpdist is not None and np is not None and strs1:
+        return cpdist(strs1, strs2, scorer=Jaro.similarity, dtype=np.float64, workers=1).tolist()
+    return list(map(jaro, strs1, strs2))
+
+
+def object_array(values):
+    # 1-d object array of the values, also when they are lists such as checksums
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+# kinds of the values the sentinel rules look at: check_empty, '' and 'NE', any other value is 0
+EMPTY, BLANK, NE = 1, 2, 3
+VALUE_KINDS = {'NONE': EMPTY, 'NOASSERTION': EMPTY, None: EMPTY, '': BLANK, 'NE': NE}
+
+
+def value_kinds(values):
+    # VALUE_KINDS of each value in one dict lookup, unhashable values (checksum lists) are compared one by one
+    try:
+        return np.fromiter(map(VALUE_KINDS.get, values, [0] * len(values)), dtype=np.int8, count=len(values))
+    except TypeError:
+        return np.fromiter([VALUE_KINDS.get(v, 0) if v.__hash__ is not None else 0 for v in values],
+                           dtype=np.int8, count=len(values))
+
+
+def sentinel_masks(values1, values2, blank_is_zero):
+    # the -1 / 0 / 1 rules of the scorers on whole arrays of aligned values: masks of the pairs scoring -1, 0 and 1,
+    # the others need the similarity. blank_is_zero: a lone '' scores 0 (equal_cmp, the substring score),
+    # text_sentinel leaves it to the similarity
+    kinds1, kinds2 = value_kinds(values1), value_kinds(values2)
+    empty1, empty2 = kinds1 == EMPTY, kinds2 == EMPTY
+    blank1, blank2 = kinds1 == BLANK, kinds2 == BLANK
+    negative = empty1 & empty2 | blank1 & blank2
+    zero = (kinds1 == NE) | (kinds2 == NE) | empty1 | empty2
+    if blank_is_zero:
+        zero |= blank1 | blank2
+    zero &= ~negative
+    one = ~negative & ~zero
+    one[one] = object_array(values1)[one] == object_array(values2)[one]
+    return negative, zero, one
+
+
+def masked_scores(values1, values2, blank_is_zero, similarity):
+    # scores of the sentinel rules as floats, -1 kept an int as the scorers return it;
+    # similarity(pending values1, pending values2) scores the rest, in the order given
+    negative, zero, one = sentinel_masks(values1, values2, blank_is_zero)
+    scores = np.where(one, 1., 0.)
+    pending = np.flatnonzero(~(negative | zero | one))
+    if len(pending):
+        scores[pending] = similarity([values1[i] for i in pending], [values2[i] for i in pending])
+    scores = scores.tolist()
+    for i in np.flatnonzero(negative).tolist():
+        scores[i] = -1
+    return scores
+
+
+def unquote_all(texts):
+    # unquote of each text, once per distinct text; a text without '%' is returned as it is
+    unquoted = {}
+    for text in texts:
+        if text not in unquoted:
+            unquoted[text] = unquote(text) if '%' in text else text
+    return [unquoted[text] for text in texts]
+
+
+def text_consistency_batch(texts1, texts2):
+    # text_consistency of aligned values: the sentinel rules on whole arrays, the rest through jaro_batch at once
+    if np is None:
+        scores = [text_sentinel(t1, t2) for t1, t2 in zip(texts1, texts2)]
+        pending = [i for i, score in enumerate(scores) if score is None]
+        similar = jaro_batch(unquote_all([texts1[i] for i in pending]), unquote_all([texts2[i] for i in pending]))
+        for i, score in zip(pending, similar):
+            scores[i] = score
+        return scores
+    return masked_scores(texts1, texts2, False, lambda t1, t2: jaro_batch(unquote_all(t1), unquote_all(t2)))
+
+
+def equal_cmp_batch(values1, values2):
+    # equal_cmp of aligned values, the ints -1 / 0 / 1 of the sentinel masks
+    if np is None:
+        return list(map(equal_cmp, values1, values2))
+    negative, _, one = sentinel_masks(values1, values2, True)
+    return np.where(negative, -1, np.where(one, 1, 0)).tolist()
+
+
+def substring_consistency_batch(strs1, strs2):
+    # longest_common_substring_consistency_score of aligned values, the sentinel rules on whole arrays and
+    # substring_similarity only for the pairs past them
+    if np is None:
+        return list(map(longest_common_substring_consistency_score, strs1, strs2))
+    return masked_scores(strs1, strs2, True, lambda s1, s2: list(map(substring_similarity, s1, s2)))
+
+
+# scorers with a batch form, the others (version_consistency with its per-part rules) are mapped over the pairs
+BATCH_SCORERS = {text_consistency: text_consistency_batch, equal_cmp: equal_cmp_batch,
+                 longest_common_substring_consistency_score: substring_consistency_batch}
+
+
+def compute_scores(values1, values2, scorer):
+    if scorer in BATCH_SCORERS:
+        return BATCH_SCORERS[scorer](values1, values2)
+    return list(map(scorer, values1, values2))
+
+
+SCORE_CACHE_SIZE = 1 << 16
+# item events of a scorer, replayed for the pairs a ScoreCache answers without calling the scorer
+SCORER_EVENTS = {version_consistency: version_special_char}
+
+
+class ScoreCache:
+    # LRU memo of the scores of value pairs, one per scorer of at most size pairs, kept per process.
+    # stats: scorer name -> [hits, misses, seconds spent on the misses]
+    def __init__(self, size: int = SCORE_CACHE_SIZE):
+        self.size = size
+        self.caches = {}
+        self.stats = {}
+
+    def scores(self, values1, values2, scorer):
+        cache = self.caches.setdefault(scorer, OrderedDict())
+        stat = self.stats.setdefault(scorer.__name__, [0, 0, 0.])
+        events = SCORER_EVENTS.get(scorer)
+        result, missed = [None] * len(values1), []
+        for i, key in enumerate(zip(values1, values2)):
+            try:
+                result[i] = cache[key]
+                cache.move_to_end(key)
+                stat[0] += 1
+                if events is not None:
+                    events(*key)
+            except (KeyError, TypeError):  # TypeError: unhashable values such as checksum lists, never cached
+                missed.append(i)
+        if not missed:
+            return result
+        start_time = time.perf_counter()
+        computed = compute_scores([values1[i] for i in missed], [values2[i] for i in missed], scorer)
+        stat[1] += len(missed)
+        stat[2] += time.perf_counter() - start_time
+        for i, score in zip(missed, computed):
+            result[i] = score
+            try:
+                cache[(values1[i], values2[i])] = score
+            except TypeError:
+                continue
+            if len(cache) > self.size:
+                cache.popitem(last=False)
+        return result
+
+
+score_cache = None
+
+
+def set_score_cache(size):
+    # memoize the scores of batch_scores with a ScoreCache of size pairs per scorer, off when size is 0 / None
+    global score_cache
+    if not size:
+        score_cache = None
+    elif score_cache is None or score_cache.size != size:
+        score_cache = ScoreCache(size)
+
+
+def score_cache_stats() -> dict:
+    # copy of the counters of the score cache of this process, {} without one
+    if score_cache is None:
+        return {}
+    return {name: list(stat) for name, stat in score_cache.stats.items()}
+
+
+def batch_scores(values1, values2, scorer):
+    # scorer(v1, v2) of aligned lists of values, the same scores and types as pair by pair
+    with stage('score.' + scorer.__name__):
+        if score_cache is not None:
+            return score_cache.scores(values1, values2, scorer)
+        return compute_scores(values1, values2, scorer)
+
+
+def score_fields(items1, items2, fields):
+    # the scores of the matched items1[i] / items2[i] for each (field, scorer) of fields, field -> list of scores
+    return {field: batch_scores([item[field] for item in items1], [item[field] for item in items2], scorer)
+            for field, scorer in fields}
+
+
+def score_arrays(items1, items2, fields):
+    # score_fields as NumPy float arrays, e.g. for the means of a tool pair
+    if np is None:
+        raise ImportError('score_arrays needs numpy')
+    return {field: np.asarray(scores, dtype=np.float64) for field, scores in score_fields(items1, items2, fields).items()}
+
+
+def score_means(arrays):
+    # mean of each array of score_arrays with the -1 sentinels counted as 1, the columns of consistency_row.
+    # For analysis only: NumPy sums pairwise, so the last digits may differ from the sequential sums of the CSVs
+    return {field: float(np.abs(scores).mean()) if len(scores) else 0. for field, scores in arrays.items()}
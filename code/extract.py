@@ -1,14 +1,18 @@
 import glob
 import hashlib
-import json
 import os
 import time
 from loguru import logger
 from .extract_cdx_ort import extract_cdx_ort
-from .utils import is_valid_json, get_filename
+from .metrics import count, enable_profiling, metrics, stage, take_metrics, write_report
+from .store import ExtractedStore, is_packed
+from .utils import (DECOMPRESS_ERRORS, NAME_SCHEME, canonical_name, deal_filename, dumps_json, get_filename, ijson,
+                    item_event, keep_name, load_json, loads_json, run_tasks, sbom_source, stream_json, take_item_events,
+                    zstandard)
 
 
-def extract_items(data: dict, filename: str, item_list: list, standard: str = 'spdx', mode: str = 'meta'):
+def extract_items(data: dict, filename: str, item_list: list, standard: str = 'spdx', mode: str = 'meta',
+                  key_field: str = None, prepare=keep_name):
     result = {}
     identifier = ''
     if standard == 'spdx' and mode == 'multiple':
@@ -17,9 +21,12 @@ def extract_items(data: dict, filename: str, item_list: list, standard: str = 's
         identifier = data.get('bom-ref', data.get('purl', hashlib.md5(data['name'].encode()).hexdigest()))
 
     if identifier == 'NE' and mode == 'multiple':
-        logger.error(f'[NoIdentifier][{identifier}]: {filename}')
+        item_event('NoIdentifier', 'ERROR', identifier, filename)
         return result
     result = {item: data.get(item, 'NE') for item in item_list}
+    # precomputed canonical name used by match.py, see NAME_SCHEME
+    if key_field is not None and isinstance(result.get(key_field), str):
+        result['match_key'] = canonical_name(prepare(result[key_field]))
 
     if mode == 'meta':
         return result
@@ -31,137 +38,285 @@ def extract_items(data: dict, filename: str, item_list: list, standard: str = 's
         return {}
 
 
-def spdx_extract(filepath: str, spdx_items: dict, result_path: str):
+def spdx_extract(filepath: str, spdx_items: dict, result_path: str, data: dict = None, packed: list = None):
+    # data: the document when extract() has already parsed it
+    # packed: a list that gets (filename, ExtractedStore.pack(document)) instead of the JSON file being written
+    # returns the missing sections, e.g. ['NoFiles']
     filename = get_filename(filepath)
     spdx_info = {}
+    issues = []
 
-    with open(filepath, 'r') as f:
-        data = json.load(f)
-        # SPDX Document Creation Information
-        create_info = extract_items(data, filename, spdx_items['create_items'], 'spdx', 'meta')
-
-        # creationInfo needs special handling
-        if 'creationInfo' in spdx_items['create_items']:
-            if 'creationInfo' in data:
-                creationInfo = data['creationInfo']
-                create_info['creators'] = creationInfo.get('creators', 'NE')
-                create_info['created'] = creationInfo.get('created', 'NE')
-            else:
-                create_info['creators'] = 'NE'
-                create_info['created'] = 'NE'
-        spdx_info['documents'] = create_info
-
-        # Extract Package Information
-        packages_info = {}
-        if 'packages' in data:
-            for pkg in data['packages']:
-                packages_info.update(extract_items(pkg, filename, spdx_items['package_items'], 'spdx', 'multiple'))
-        else:
-            packages_info = 'NE'
-            logger.error(f'[NoPackages]: {filepath}')
-        spdx_info['packages'] = packages_info
-
-        # Extract File Information
-        files_info = {}
-        if 'files' in data:
-            for file in data['files']:
-                files_info.update(extract_items(file, filename, spdx_items['file_items'], 'spdx', 'multiple'))
+    if data is None:
+        data = load_json(filepath)
+    # SPDX Document Creation Information
+    create_info = extract_items(data, filename, spdx_items['create_items'], 'spdx', 'meta')
+
+    # creationInfo needs special handling
+    if 'creationInfo' in spdx_items['create_items']:
+        if 'creationInfo' in data:
+            creationInfo = data['creationInfo']
+            create_info['creators'] = creationInfo.get('creators', 'NE')
+            create_info['created'] = creationInfo.get('created', 'NE')
         else:
-            files_info = 'NE'
-            logger.error(f'[NoFiles]: {filepath}')
-        spdx_info['files'] = files_info
+            create_info['creators'] = 'NE'
+            create_info['created'] = 'NE'
+    spdx_info['documents'] = create_info
+
+    # Extract Package Information
+    packages_info = {}
+    if 'packages' in data:
+        for pkg in data['packages']:
+            packages_info.update(extract_items(pkg, filename, spdx_items['package_items'], 'spdx', 'multiple', 'name'))
+    else:
+        packages_info = 'NE'
+        logger.error(f'[NoPackages]: {filepath}')
+        issues.append('NoPackages')
+    spdx_info['packages'] = packages_info
+
+    # Extract File Information
+    files_info = {}
+    if 'files' in data:
+        for file in data['files']:
+            files_info.update(extract_items(file, filename, spdx_items['file_items'], 'spdx', 'multiple',
+                                            'fileName', deal_filename))
+    else:
+        files_info = 'NE'
+        logger.error(f'[NoFiles]: {filepath}')
+        issues.append('NoFiles')
+    spdx_info['files'] = files_info
+    spdx_info['scheme'] = NAME_SCHEME
+
+    if packed is not None:
+        packed.append((filename, ExtractedStore.pack(spdx_info)))
+        return issues
 
     # Write to JSON file
-    spdx_info = json.dumps(spdx_info, indent=4)
+    spdx_info = dumps_json(spdx_info)
     write_path = os.path.join(result_path, filename + '.json')
     with open(write_path, 'w') as f:
         f.write(spdx_info)
     logger.info(f'[SPDXExtractionSucceed]: {write_path}')
+    return issues
 
 
-def cdx_extract(filepath: str, cdx_items: dict, result_path: str):
+def cdx_extract(filepath: str, cdx_items: dict, result_path: str, data: dict = None, packed: list = None):
+    # data: the document when extract() has already parsed it
+    # packed: a list that gets (filename, ExtractedStore.pack(document)) instead of the JSON file being written
+    # returns the missing sections, e.g. ['NoComponents']
     filename = get_filename(filepath)
     cdx_info = {}
+    issues = []
 
-    with open(filepath, 'r') as f:
-        data = json.load(f)
+    if data is None:
+        data = load_json(filepath)
 
-        # Metadata Information
-        meta_info = {}
-        meta_info = extract_items(data, filename, cdx_items['metadata']['create_items'], 'cdx', 'meta')
+    # Metadata Information
+    meta_info = {}
+    meta_info = extract_items(data, filename, cdx_items['metadata']['create_items'], 'cdx', 'meta')
 
-        metadata = data.get('metadata', {})
-        meta_info.update(extract_items(metadata, filename, cdx_items['metadata']['meta_items'], 'cdx', 'meta'))
+    metadata = data.get('metadata', {})
+    meta_info.update(extract_items(metadata, filename, cdx_items['metadata']['meta_items'], 'cdx', 'meta'))
 
-        comp_in_metadata = metadata.get('component', {})
-        comp_in_meta_items = extract_items(comp_in_metadata, filename, cdx_items['metadata']['comp_in_meta_items'], 'cdx', 'meta')
-        # deal with same name
-        comp_in_meta_items.update({'name_com': comp_in_meta_items.pop('name')})
-        comp_in_meta_items.update({'version_com': comp_in_meta_items.pop('version')})
-        meta_info.update(comp_in_meta_items)
+    comp_in_metadata = metadata.get('component', {})
+    comp_in_meta_items = extract_items(comp_in_metadata, filename, cdx_items['metadata']['comp_in_meta_items'], 'cdx', 'meta')
+    # deal with same name
+    comp_in_meta_items.update({'name_com': comp_in_meta_items.pop('name')})
+    comp_in_meta_items.update({'version_com': comp_in_meta_items.pop('version')})
+    meta_info.update(comp_in_meta_items)
 
-        cdx_info['metadata'] = meta_info
+    cdx_info['metadata'] = meta_info
 
-        # Component Information
-        comp_info = {}
-        if 'components' in data:
-            for comp in data['components']:
-                comp_info.update(extract_items(comp, filename, cdx_items['components_items'], 'cdx', 'multiple'))
-        else:
-            comp_info = 'NE'
-            logger.error(f'[NoComponents]: {filepath}')
-        cdx_info['components'] = comp_info
+    # Component Information
+    comp_info = {}
+    if 'components' in data:
+        for comp in data['components']:
+            comp_info.update(extract_items(comp, filename, cdx_items['components_items'], 'cdx', 'multiple', 'name'))
+    else:
+        comp_info = 'NE'
+        logger.error(f'[NoComponents]: {filepath}')
+        issues.append('NoComponents')
+    cdx_info['components'] = comp_info
+    cdx_info['scheme'] = NAME_SCHEME
+
+    if packed is not None:
+        packed.append((filename, ExtractedStore.pack(cdx_info)))
+        return issues
 
     # Write to JSON file
-    cdx_info = json.dumps(cdx_info, indent=4)
+    cdx_info = dumps_json(cdx_info)
     write_path = os.path.join(result_path, filename + '.json')
     with open(write_path, 'w') as f:
         f.write(cdx_info)
     logger.info(f'[CDXExtractionSucceed]: {write_path}')
+    return issues
 
 
-def extract(filenames, file_path, result_path):
-    spdx_items = {
-        'create_items': ['SPDXID', 'name', 'spdxVersion', 'dataLicense', 'documentNamespace', 'creationInfo'],
-        'package_items': ['name', 'SPDXID', 'downloadLocation', 'packageVerificationCode',
-                          'versionInfo', 'originator', 'supplier', 'copyrightText'],  # and more......
-        'file_items': ['fileName', 'SPDXID', 'checksums']
-    }
-    cdx_items = {
-        'metadata': {
-            'create_items': ['bomFormat', 'specVersion', 'version', 'serialNumber'],
-            'meta_items': ['timestamp', 'tools'],
-            'comp_in_meta_items': ['name', 'version', 'bom-ref']  # renamed into name_com, version_com
-        },
-        'components_items': ['name', 'author', 'type', 'bom-ref', 'purl', 'version', 'copyright', 'cpe']  # and more......
-    }
-    cdx_ort_items = {
-        'metadata': {
-            'create_items': ['bomFormat', '@xmlns', '@version', '@serialNumber'],  # Need special handle in ORT
-            'meta_items': ['timestamp', 'tools'],
-            'comp_in_meta_items': ['name', 'version', 'bom-ref']  # Need special handle in ORT  # renamed into name_com, version_com
-        },
-        'components_items': ['name', 'author', 'type', 'bom-ref', 'purl', 'version', 'copyright', 'cpe']  # and more......
-    }
+SPDX_ITEMS = {
+    'create_items': ['SPDXID', 'name', 'spdxVersion', 'dataLicense', 'documentNamespace', 'creationInfo'],
+    'package_items': ['name', 'SPDXID', 'downloadLocation', 'packageVerificationCode',
+                      'versionInfo', 'originator', 'supplier', 'copyrightText'],  # and more......
+    'file_items': ['fileName', 'SPDXID', 'checksums']
+}
+CDX_ITEMS = {
+    'metadata': {
+        'create_items': ['bomFormat', 'specVersion', 'version', 'serialNumber'],
+        'meta_items': ['timestamp', 'tools'],
+        'comp_in_meta_items': ['name', 'version', 'bom-ref']  # renamed into name_com, version_com
+    },
+    'components_items': ['name', 'author', 'type', 'bom-ref', 'purl', 'version', 'copyright', 'cpe']  # and more......
+}
+CDX_ORT_ITEMS = {
+    'metadata': {
+        'create_items': ['bomFormat', '@xmlns', '@version', '@serialNumber'],  # Need special handle in ORT
+        'meta_items': ['timestamp', 'tools'],
+        'comp_in_meta_items': ['name', 'version', 'bom-ref']  # Need special handle in ORT  # renamed into name_com, version_com
+    },
+    'components_items': ['name', 'author', 'type', 'bom-ref', 'purl', 'version', 'copyright', 'cpe']  # and more......
+}
+# top-level fields and per-element fields of the top-level arrays read by the streaming parser
+STREAM_SPDX = (SPDX_ITEMS['create_items'],
+               {'packages': SPDX_ITEMS['package_items'], 'files': SPDX_ITEMS['file_items']})
+STREAM_CDX = (CDX_ITEMS['metadata']['create_items'] + ['metadata'],
+              {'components': CDX_ITEMS['components_items']})
 
-    with open(filenames, 'r') as f:
-        line = f.readline().strip()
-        while line:
-            filepath = os.path.join(file_path, line)
-            if not os.path.exists(filepath):
-                logger.error(f'[FileNotFound]: {filepath}')
-                line = f.readline().strip()
-                continue
-            if not is_valid_json(filepath):
-                logger.error(f'[InvalidJSON]: {filepath}')
-                line = f.readline().strip()
-                continue
+
+def extract_file(task):
+    # extract one input SBOM, run in the worker processes of extract()
+    # returns (line, issues, size in MB, seconds, packed document or None, item event counts, measurements or None),
+    # issues is empty when nothing went wrong
+    line, stored_name, file_path, result_path, stream = task
+    take_item_events()
+    source = sbom_source(file_path)
+    filepath = os.path.join(file_path, line)
+    packed = [] if is_packed(result_path) else None
+    start_time = time.perf_counter()
+    # parse once, a decode error is the invalid JSON signal
+    try:
+        with stage('extract.parse'):
+            if stream and 'spdx' in line:
+                data = stream_json(source.open(stored_name), *STREAM_SPDX)
+            elif stream and 'cdx' in line and 'cdx#ort' not in line:
+                data = stream_json(source.open(stored_name), *STREAM_CDX)
+            else:
+                data = loads_json(source.read(stored_name))
+    except (ValueError,) + DECOMPRESS_ERRORS + ((ijson.JSONError,) if ijson else ()):
+        return line, ['InvalidJSON'], 0, 0, None, {}, take_metrics()
+    count('extract.bytes_read', source.size(stored_name))
+    issues = []
+    # a document of unexpected shape fails alone, the rest of the batch goes on
+    try:
+        with stage('extract.write'):
             if 'spdx' in line:
-                spdx_extract(filepath, spdx_items, result_path)
+                issues = spdx_extract(filepath, SPDX_ITEMS, result_path, data, packed)
             elif 'cdx#ort' in line:
-                extract_cdx_ort(filepath, cdx_ort_items, result_path)  # empty code
+                extract_cdx_ort(filepath, CDX_ORT_ITEMS, result_path)  # empty code
             elif 'cdx' in line:
-                cdx_extract(filepath, cdx_items, result_path)
+                issues = cdx_extract(filepath, CDX_ITEMS, result_path, data, packed)
             else:
                 logger.error(f'[UnknownFormat]: {filepath}')
+                issues = ['UnknownFormat']
+    except Exception as e:
+        logger.error(f'[ExtractError]: {filepath}||{type(e).__name__}: {e}')
+        return line, ['ExtractError'], 0, 0, None, take_item_events(), take_metrics()
+    del data
+    blob = packed[0][1] if packed else None
+    return (line, issues, source.size(stored_name) / 1024 ** 2, time.perf_counter() - start_time, blob, take_item_events(),
+            take_metrics())
+
+
+def extract(filenames, file_path, result_path, manifest=None, stream=False, jobs=1, profile=None):
+    # file_path: directory of the input SBOMs, or a zip archive of them that is read without unpacking.
+    #            an input is also read compressed as name.gz / name.zst
+    # result_path: directory of the extracted JSON files, or an ExtractedStore file (*.db) they are packed into
+    # manifest: a RunManifest, inputs unchanged since their last extraction are skipped
+    # stream: parse the inputs event by event with ijson and keep only the fields below, for very large SBOMs
+    # jobs: number of worker processes, the largest inputs are handed out first so none of them is left as the tail
+    # profile: directory of the stage profile reports (JSON and Prometheus textfile), SAP_PROFILE sets it as well
+    # returns the summary: extracted / unchanged counts, the inputs of each error, e.g. {'InvalidJSON': [...]},
+    # and the item event counts, e.g. {'NoIdentifier': 3}
+    if profile:
+        enable_profiling(profile)
+    run_start = time.perf_counter()
+    if stream and ijson is None:
+        logger.warning('[NoIjson]: streaming extraction needs ijson, the inputs are loaded whole')
+        stream = False
+    source = sbom_source(file_path)
+    store = ExtractedStore(result_path) if is_packed(result_path) else None
+    stored = set(store.hashes()) if store is not None else set()
+
+    lines = []
+    with open(filenames, 'r') as f:
+        line = f.readline().strip()
+        while line:
+            lines.append(line)
             line = f.readline().strip()
+
+    summary = {'extracted': 0, 'unchanged': 0, 'errors': {}, 'events': {}}
+    tasks, input_hashes = [], {}
+    for line in lines:
+        filepath = os.path.join(file_path, line)
+        stored_name = source.resolve(line)
+        if stored_name is None:
+            logger.error(f'[FileNotFound]: {filepath}')
+            summary['errors'].setdefault('FileNotFound', []).append(line)
+            continue
+        if stored_name.endswith('.zst') and zstandard is None:
+            logger.error(f'[NoZstandard]: {filepath}.zst needs zstandard')
+            summary['errors'].setdefault('NoZstandard', []).append(line)
+            continue
+        if manifest is not None:
+            filename = get_filename(filepath)
+            input_hash = source.fingerprint(stored_name) or \
+                manifest.content_hash('inputs', line, os.path.join(file_path, stored_name))
+            if input_hash == manifest.recorded('inputs', line) and \
+                    (filename in stored or os.path.exists(os.path.join(result_path, filename + '.json'))):
+                logger.debug(f'[Unchanged]: {filepath}')
+                summary['unchanged'] += 1
+                continue
+            input_hashes[line] = input_hash
+        tasks.append((line, stored_name, file_path, result_path, stream))
+    if jobs > 1:
+        tasks.sort(key=lambda task: source.size(task[1]), reverse=True)
+
+    for line, issues, size, elapsed_time, blob, events, file_metrics in run_tasks(extract_file, tasks, jobs, chunksize=1):
+        filepath = os.path.join(file_path, line)
+        if file_metrics is not None:
+            metrics.add(file_metrics)
+        for tag, tag_count in events.items():
+            summary['events'][tag] = summary['events'].get(tag, 0) + tag_count
+        for issue in issues:
+            summary['errors'].setdefault(issue, []).append(line)
+        if 'InvalidJSON' in issues:
+            logger.error(f'[InvalidJSON]: {filepath}')
+            continue
+        if 'ExtractError' in issues:
+            continue
+        logger.info(f'[ExtractThroughput]: {filepath}||{size:.2f}MB||{size / max(elapsed_time, 1e-9):.2f}MB/s')
+        write_path = os.path.join(result_path, get_filename(filepath) + '.json')
+        if store is not None and blob is not None:
+            store.put(get_filename(filepath), blob)
+        elif store is not None or not os.path.exists(write_path):
+            continue
+        summary['extracted'] += 1
+        if manifest is not None:
+            stored_path = os.path.join(file_path, source.resolve(line)) if source.archive is None else None
+            manifest.record('inputs', line, stored_path, input_hashes[line])
+            if store is None:
+                manifest.record('extracted', os.path.basename(write_path), write_path)
+        if summary['extracted'] % 500 == 0:
+            # the documents are committed before the manifest marks their inputs as extracted
+            if store is not None:
+                store.commit()
+            if manifest is not None:
+                manifest.save()
+    if store is not None:
+        store.close()
+    if manifest is not None:
+        manifest.save()
+
+    errors = ', '.join(f'{issue}={len(failed)}' for issue, failed in sorted(summary['errors'].items()))
+    logger.info(f'[ExtractSummary]: extracted={summary["extracted"]}, unchanged={summary["unchanged"]}, {errors or "no errors"}')
+    if summary['events']:
+        logger.info(f'[ItemEvents]: extract||{dumps_json(summary["events"], indent=False)}')
+    write_report('extract', time.perf_counter() - run_start)
+    return summary
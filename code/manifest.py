@@ -0,0 +1,62 @@
+import hashlib
+import os
+from loguru import logger
+from .utils import dumps_json, load_json
+
+
+def hash_file(path, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class RunManifest:
+    # state of a checkpointed extract + match run, kept in one JSON file:
+    #   inputs:    input SBOM name -> size, mtime and content hash of the version that was extracted
+    #   extracted: extracted file name -> size, mtime and content hash
+    #   units:     standard -> repo -> 'tool1|tool2' -> hashes of the two extracted files that were matched
+    def __init__(self, path: str):
+        self.path = path
+        self.data = {'inputs': {}, 'extracted': {}, 'units': {}}
+        if os.path.exists(path):
+            self.data.update(load_json(path))
+            logger.info(f'[ManifestLoaded]: {path}')
+
+    def content_hash(self, section: str, key: str, path: str, refresh: bool = False):
+        # hash of path, the recorded one is reused while size and mtime are unchanged.
+        # refresh: record the new hash when the file changed, for sections that cache the current state
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        entry = self.data[section].get(key)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['hash']
+        content_hash = hash_file(path)
+        if refresh:
+            self.record(section, key, path, content_hash)
+        return content_hash
+
+    def recorded(self, section: str, key: str):
+        entry = self.data[section].get(key)
+        return entry['hash'] if entry is not None else None
+
+    def record(self, section: str, key: str, path: str, content_hash: str = None) -> None:
+        # path None: content_hash of something that is not a file, e.g. an archive member
+        if path is None:
+            self.data[section][key] = {'size': None, 'mtime': None, 'hash': content_hash}
+            return
+        stat = os.stat(path)
+        self.data[section][key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                                   'hash': content_hash or hash_file(path)}
+
+    def units(self, standard: str) -> dict:
+        return self.data['units'].setdefault(standard, {})
+
+    def save(self) -> None:
+        # write aside and rename, a crash never leaves a truncated manifest
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(dumps_json(self.data))
+        os.replace(tmp_path, self.path)
@@ -1,30 +1,122 @@
 import csv
 import os
-import re
 import math
+import time
 from loguru import logger
 from Levenshtein import jaro
-from urllib.parse import unquote
-from .utils import is_valid_json, parse_fileinfo, write_row2csv
-from .evaluate import check_empty, equal_cmp, longest_common_substring_consistency_score, version_consistency, text_consistency
+from .utils import (NAME_SCHEME, ResultSink, canonical_name, deal_filename, drop_rows, dumps_json, is_valid_json, item_event,
+                    keep_name, parse_fileinfo, run_tasks, take_item_events)
+from .metrics import count, enable_profiling, metrics, repo_time, stage, take_metrics, write_report
+from .store import ExtractedStore, is_packed
+from .evaluate import (SCORE_CACHE_SIZE, batch_scores, check_empty, equal_cmp, longest_common_substring_consistency_score,
+                       score_cache_stats, score_fields, set_score_cache, text_consistency, version_consistency)
 
 
-def deal_filename(name):
-    # deal with filenames in Files Section
-    if name.startswith('./'):
-        name = name[2:]
-    elif name.startswith('/'):
-        name = name[1:]
-    return name
+def compareName(name1, name2):
+    return canonical_name(name1) == canonical_name(name2)
 
 
-def compareName(name1, name2):
-    # fix encoding problem
-    name1, name2 = unquote(name1), unquote(name2)
-    # removing prefixes
-    name1 = re.sub("npm:|pip:|go:|actions:|composer:|rust:|ruby:|nuget:|rubygems:|docker:|maven:| ", '', name1).lower()
-    name2 = re.sub("npm:|pip:|go:|actions:|composer:|rust:|ruby:|nuget:|rubygems:|docker:|maven:| ", '', name2).lower()
-    return name1 == name2
+# rough cost of one index entry: dict slot, list, (position, key) tuple, key string header
+INDEX_ENTRY_BYTES = 240
+MAX_INDEX_BYTES = 1 << 30
+
+
+def estimate_index_bytes(items, field):
+    return sum(INDEX_ENTRY_BYTES + len(items[k][field]) for k in items)
+
+
+def has_match_keys(filedata):
+    # extracted files of the current NAME_SCHEME carry a precomputed match_key per item
+    return filedata.get('scheme') == NAME_SCHEME
+
+
+def item_key(item, field, prepare=keep_name, keyed=False):
+    if keyed and 'match_key' in item:
+        return item['match_key']
+    return canonical_name(prepare(item[field]))
+
+
+def index_by_name(items, field, prepare=keep_name, keyed=False):
+    # canonical name -> [(position, key)] in document order
+    index = {}
+    for pos, k in enumerate(items):
+        index.setdefault(item_key(items[k], field, prepare, keyed), []).append((pos, k))
+    return index
+
+
+def join_by_name(items1, items2, field, join='hash', prepare=keep_name, keyed=(False, False)):
+    # yield (k1, k2, pos2) for every item of items1, k2 and pos2 are None when nothing matched.
+    # first-match-wins: an item of items2 is skipped if its name was already matched by items1
+    # prepare: applied to the names before the canonical normalization, e.g. deal_filename
+    # keyed: whether items1 / items2 carry precomputed match keys, only used by the hash join
+    matched = set()
+    if join == 'nested':
+        keys2 = list(items2)
+        for k1 in items1:
+            name1 = items1[k1][field]
+            hit = (None, None)
+            for pos, k2 in enumerate(keys2):
+                name2 = items2[k2][field]
+                if compareName(prepare(name1), prepare(name2)):
+                    if name1 in matched or name2 in matched:
+                        continue
+                    matched.add(name1)
+                    hit = (k2, pos)
+                    break
+            yield (k1,) + hit
+    elif join == 'hash':
+        index = index_by_name(items2, field, prepare, keyed[1])
+        for k1 in items1:
+            name1 = items1[k1][field]
+            hit = (None, None)
+            if name1 not in matched:
+                for pos, k2 in index.get(item_key(items1[k1], field, prepare, keyed[0]), ()):
+                    if items2[k2][field] not in matched:
+                        matched.add(name1)
+                        hit = (k2, pos)
+                        break
+            yield (k1,) + hit
+    else:
+        logger.error(f'[UnknownJoin]: {join}')
+
+
+# scorers of the matched packages, field -> score; the package columns follow this order,
+# SPDX has the packageVerificationCode score before the downloadLocation one
+CDX_SCORES = [('author', text_consistency), ('type', equal_cmp), ('purl', longest_common_substring_consistency_score),
+              ('cpe', longest_common_substring_consistency_score), ('version', version_consistency)]
+SPDX_SCORES = [('originator', text_consistency), ('supplier', text_consistency), ('copyrightText', text_consistency),
+               ('versionInfo', version_consistency), ('downloadLocation', longest_common_substring_consistency_score)]
+
+
+# headers of {standard}-{tool1}-{tool2}-package-consistency.csv
+PAIR_COLUMNS = {
+    'cdx': [
+        'repo_name', 'repo_name_meta', 'repo_version', 'comp_num1', 'comp_num2', 'matched_comps',
+        'author_score', 'type_score', 'purl_score', 'cpe_score', 'version_score'
+    ],
+    'spdx': [
+        'repo_name', 'files_num1', 'files_num2', 'matched_files', 'pkgs_num1', 'pkgs_num2', 'matched_pkgs',
+        # repo info
+        'doc_name', 'originator_score_r', 'supplier_score_r', 'copyright_score_r', 'version_score_r', 'PVC_score_r', 'dL_score_r',
+        # pkg info
+        'originator_score', 'supplier_score', 'copyright_score', 'version_score', 'PVC_score', 'dL_score',
+        # file info
+        'checksum_score'
+    ]
+}
+# headers of {standard}-special-consistency.csv, the scores are the ones of pkg_info
+SPECIAL_COLUMNS = {
+    'cdx': [
+        'standard', 'tool1', 'tool2', 'repo_name', 'pkg_name',
+        'author_score', 'type_score', 'purl_score', 'cpe_score', 'version_score'
+    ],
+    # ['spdx', tool1, tool2, reponame1, pkg1['name']] + result + [neg_cpe, neg_purl]
+    'spdx': [
+        'standard', 'tool1', 'tool2', 'repo_name', 'pkg_name',
+        # below are for pkgs
+        'originator_score', 'supplier_score', 'copyright_score', 'version_score', 'PVC_score', 'dL_score'
+    ]
+}
 
 
 def deal_license(license):
@@ -39,10 +131,17 @@ def license_consistency(license1, license2):
     return 0
 
 
-def match_cdx(file1_path, file2_path, result_path):
+def fileinfo(file):
+    # a path of an extracted file, or its parse_fileinfo tuple already loaded by load_repo
+    if isinstance(file, str):
+        return parse_fileinfo(file)
+    return file
+
+
+def match_cdx(file1_path, file2_path, result_path, join='hash'):
     # match process is built on the basis of the extracted data by extract.py
-    filename1, tool1, reponame1, filedata1 = parse_fileinfo(file1_path)
-    filename2, tool2, reponame2, filedata2 = parse_fileinfo(file2_path)
+    filename1, tool1, reponame1, filedata1 = fileinfo(file1_path)
+    filename2, tool2, reponame2, filedata2 = fileinfo(file2_path)
     metadata1, metadata2 = filedata1['metadata'], filedata2['metadata']
     component1, component2 = filedata1['components'], filedata2['components']
     cmp_flag = True
@@ -68,35 +167,36 @@ def match_cdx(file1_path, file2_path, result_path):
                                            version_consistency(metadata1['version_com'], metadata2['version_com'])]
     all_matched_scores['pkg_info'] = []
     all_matched_scores['statistic_info'] = []
+    all_matched_scores['special_info'] = []  # rows of special-consistency.csv, written by match()
+    all_matched_scores['pkg_names'] = []  # names of the packages in pkg_info
     matched_pkg = []
     if not cmp_flag:
         all_matched_scores['statistic_info'] += [0, 0, 0]
         all_matched_scores['pkg_info'] = [[0, 0, 0, 0, 0]]
         return all_matched_scores
 
-    for k1 in component_keys1:
-        pkg1 = component1[k1]
-        for k2 in component_keys2:
-            pkg2 = component2[k2]
-            if compareName(pkg1['name'], pkg2['name']):
-                if pkg1['name'] in matched_pkg or pkg2['name'] in matched_pkg:
-                    continue
-                matched_pkg.append(pkg1['name'])
-                author_score = text_consistency(pkg1['author'], pkg2['author'])
-                type_score = equal_cmp(pkg1['type'], pkg2['type'])
-                purl_score = longest_common_substring_consistency_score(pkg1['purl'], pkg2['purl'])
-                cpe_score = longest_common_substring_consistency_score(pkg1['cpe'], pkg2['cpe'])
-                # license_score = license_consistency(pkg1['licenses'], pkg2['licenses'])
-                version_score = version_consistency(pkg1['version'], pkg2['version'])
-                result = [author_score, type_score, purl_score, cpe_score, version_score]
-
-                if any(x < 0 for x in result):
-                    with open(f'{result_path}/cdx-special-consistency.csv', 'a') as fd:
-                        writer = csv.writer(fd)
-                        writer.writerow(['cdx', tool1, tool2, reponame1, pkg1['name']] + result)
-                        all_matched_scores['pkg_info'].append([math.fabs(x) for x in result])
-                else:
-                    all_matched_scores['pkg_info'].append(result)
+    keyed = (has_match_keys(filedata1), has_match_keys(filedata2))
+    matched1, matched2 = [], []
+    count('cdx.component_comparisons', len(component1) * len(component2))
+    with stage('match.join'):
+        for k1, k2, _ in join_by_name(component1, component2, 'name', join, keyed=keyed):
+            if k2 is None:
+                continue
+            matched1.append(component1[k1])
+            matched2.append(component2[k2])
+    # score all matched components at once, the columns of CDX_SCORES
+    # license_score = license_consistency(pkg1['licenses'], pkg2['licenses'])
+    scores = score_fields(matched1, matched2, CDX_SCORES)
+    for pkg1, result in zip(matched1, zip(*[scores[field] for field, _ in CDX_SCORES])):
+        result = list(result)
+        matched_pkg.append(pkg1['name'])
+
+        if any(x < 0 for x in result):
+            all_matched_scores['special_info'].append(['cdx', tool1, tool2, reponame1, pkg1['name']] + result)
+            all_matched_scores['pkg_info'].append([math.fabs(x) for x in result])
+        else:
+            all_matched_scores['pkg_info'].append(result)
+        all_matched_scores['pkg_names'].append(pkg1['name'])
 
     if len(all_matched_scores['pkg_info']) == 0:
         all_matched_scores['pkg_info'].append([0, 0, 0, 0, 0])
@@ -120,7 +220,7 @@ def deal_PVC(PVC):
         return PVC
     elif type(PVC) == list:
         if len(PVC) == 1:
-            logger.info(f'[ListPVC]: {PVC}||{PVC[0]}')
+            item_event('ListPVC', 'INFO', PVC, PVC[0])
             return PVC[0]
     elif type(PVC) == dict:
         if 'packageVerificationCodeValue' in PVC:
@@ -129,9 +229,9 @@ def deal_PVC(PVC):
     return None
 
 
-def match_spdx(file1_path, file2_path, result_path):
-    filename1, tool1, reponame1, filedata1 = parse_fileinfo(file1_path)
-    filename2, tool2, reponame2, filedata2 = parse_fileinfo(file2_path)
+def match_spdx(file1_path, file2_path, result_path, join='hash'):
+    filename1, tool1, reponame1, filedata1 = fileinfo(file1_path)
+    filename2, tool2, reponame2, filedata2 = fileinfo(file2_path)
     doc1, doc2 = filedata1['documents'], filedata2['documents']
     pkgs1, pkgs2 = filedata1['packages'], filedata2['packages']
     files1, files2 = filedata1['files'], filedata2['files']
@@ -154,58 +254,63 @@ def match_spdx(file1_path, file2_path, result_path):
     all_matched_scores['pkg_info'] = []
     all_matched_scores['files_info'] = []
     all_matched_scores['statistic_info'] = []
+    all_matched_scores['special_info'] = []  # rows of special-consistency.csv, written by match()
+    all_matched_scores['pkg_names'] = []  # names of the packages in pkg_info
 
     repo1_flag = False
     repo2_flag = False
-    if files_flag:
-        matched_files = []
-        for key1 in files_keys1:
-            if len(files_keys1) > 2000 or len(files_keys2) > 2000:  # filter out too many files
+    keyed = (has_match_keys(filedata1), has_match_keys(filedata2))
+    with stage('match.files'):
+        if files_flag:
+            matched_files = []
+            count('spdx.file_comparisons', len(files1) * len(files2))
+            if estimate_index_bytes(files2, 'fileName') > MAX_INDEX_BYTES:  # filter out files the index cannot hold
                 logger.warning(f'[TooManyFiles]: {tool1}||{tool2}||{reponame1}')
-                break
-            f1 = files1[key1]
-            for f2 in files_keys2:
-                f2 = files2[f2]
-                if compareName(deal_filename(f1['fileName']), deal_filename(f2['fileName'])):  # deal with relative path
-                    if f1['fileName'] in matched_files or f2['fileName'] in matched_files:
-                        continue
-                    matched_files.append(f1['fileName'])
-                    if len(f1['checksums']) == 0 or len(f2['checksums']) == 0:
-                        checksum_score = 0.
-
-                    elif len(f1['checksums']) == 1 and len(f2['checksums']) == 1:
-                        checksum_score = equal_cmp(f1['checksums'][0]['checksumValue'], f2['checksums'][0]['checksumValue'])
-
-                        if checksum_score == 1:
-                            logger.success(f"[SameChecksum]{f1['checksums'][0]['checksumValue']}, {f2['checksums'][0]['checksumValue']}")
-                        elif checksum_score == -1:
-                            logger.error(
-                                f'[SpecialChecksum]: spdx||{tool1}||{tool2}||{reponame1}||{f1["fileName"]}||{f1["checksums"][0]["checksumValue"]}||{f2["checksums"][0]["checksumValue"]}')
-                            checksum_score = 1
-                        else:
-                            logger.error(
-                                f'[DiffChecksum]: spdx||{tool1}||{tool2}||{reponame1}||{f1["fileName"]}||{f2["fileName"]}||{f1["checksums"][0]["checksumValue"]}||{f2["checksums"][0]["checksumValue"]}')
+                files_pairs = []
+            else:
+                files_pairs = join_by_name(files1, files2, 'fileName', join, deal_filename, keyed)  # deal with relative path
+            for k1, k2, _ in files_pairs:
+                if k2 is None:
+                    continue
+                f1, f2 = files1[k1], files2[k2]
+                matched_files.append(f1['fileName'])
+                if len(f1['checksums']) == 0 or len(f2['checksums']) == 0:
+                    checksum_score = 0.
+
+                elif len(f1['checksums']) == 1 and len(f2['checksums']) == 1:
+                    checksum_score = equal_cmp(f1['checksums'][0]['checksumValue'], f2['checksums'][0]['checksumValue'])
+
+                    if checksum_score == 1:
+                        item_event('SameChecksum', 'SUCCESS', f1['checksums'][0]['checksumValue'], f2['checksums'][0]['checksumValue'])
+                    elif checksum_score == -1:
+                        item_event('SpecialChecksum', 'ERROR', 'spdx', tool1, tool2, reponame1, f1['fileName'],
+                                   f1['checksums'][0]['checksumValue'], f2['checksums'][0]['checksumValue'])
+                        checksum_score = 1
                     else:
-                        len1, len2 = len(f1['checksums']), len(f2['checksums'])
-                        checksum_score = 0.
-                        for c1 in f1['checksums']:
-                            for c2 in f2['checksums']:
-                                if c1['algorithm'] == c2['algorithm']:
-                                    logger.debug(
-                                        f'[MatchFileAndAlgorithm]: spdx||{tool1}||{tool2}||{reponame1}||{f1["fileName"]}||{f2["fileName"]}||{c1["checksumValue"]}||{c2["checksumValue"]}')
-                                    c = equal_cmp(c1['checksumValue'], c2['checksumValue'])
-                                    if c == -1:
-                                        checksum_score += 1
-                                        logger.error(
-                                            f'[SpecialChecksum]: spdx||{tool1}||{tool2}||{reponame1}||{f1["fileName"]}||{c1["checksumValue"]}||{c2["checksumValue"]}')
-                                    else:
-                                        checksum_score += c
-                        checksum_score /= max(len(f1['checksums']), len(f2['checksums']))
-                    all_matched_scores['files_info'].append([checksum_score])
-
-        if len(all_matched_scores['files_info']) == 0:
-            all_matched_scores['files_info'].append([0])
-        all_matched_scores['statistic_info'] += [len(files_keys1), len(files_keys2), len(matched_files)]
+                        item_event('DiffChecksum', 'ERROR', 'spdx', tool1, tool2, reponame1, f1['fileName'], f2['fileName'],
+                                   f1['checksums'][0]['checksumValue'], f2['checksums'][0]['checksumValue'])
+                else:
+                    len1, len2 = len(f1['checksums']), len(f2['checksums'])
+                    checksum_score = 0.
+                    for c1 in f1['checksums']:
+                        for c2 in f2['checksums']:
+                            if c1['algorithm'] == c2['algorithm']:
+                                item_event('MatchFileAndAlgorithm', 'DEBUG', 'spdx', tool1, tool2, reponame1, f1['fileName'],
+                                           f2['fileName'], c1['checksumValue'], c2['checksumValue'])
+                                c = equal_cmp(c1['checksumValue'], c2['checksumValue'])
+                                if c == -1:
+                                    checksum_score += 1
+                                    item_event('SpecialChecksum', 'ERROR', 'spdx', tool1, tool2, reponame1, f1['fileName'],
+                                               c1['checksumValue'], c2['checksumValue'])
+                                else:
+                                    checksum_score += c
+                    checksum_score /= max(len(f1['checksums']), len(f2['checksums']))
+                all_matched_scores['files_info'].append([checksum_score])
+
+            if len(all_matched_scores['files_info']) == 0:
+                all_matched_scores['files_info'].append([0])
+            all_matched_scores['statistic_info'] += [len(files_keys1), len(files_keys2), len(matched_files)]
+            logger.info(f'[MatchedFiles]: {tool1}||{tool2}||{reponame1}||{len(matched_files)}/{len(files_keys1)}/{len(files_keys2)}')
 
     if not files_flag:
         all_matched_scores['statistic_info'] += [0, 0, 0]
@@ -218,50 +323,52 @@ def match_spdx(file1_path, file2_path, result_path):
         return all_matched_scores
 
     matched_pkg = []
-    for k1 in pkgs_keys1:
-        pkg1 = pkgs1[k1]
-        if compareName(pkg1['name'], reponame1):
-            repo1_flag = True
-        for k2 in pkgs_keys2:
-            pkg2 = pkgs2[k2]
-            if compareName(pkg2['name'], reponame1):
-                repo2_flag = True
-            if compareName(pkg1['name'], pkg2['name']):
-                if pkg1['name'] in matched_pkg or pkg2['name'] in matched_pkg:
-                    continue
-                matched_pkg.append(pkg1['name'])
-
-                originator_score = text_consistency(pkg1['originator'], pkg2['originator'])
-                supplier_score = text_consistency(pkg1['supplier'], pkg2['supplier'])
-                copyright_score = text_consistency(pkg1['copyrightText'], pkg2['copyrightText'])
-
-                version_score = version_consistency(pkg1['versionInfo'], pkg2['versionInfo'])
-
-                PVC_score = equal_cmp(deal_PVC(pkg1['packageVerificationCode']), deal_PVC(pkg2['packageVerificationCode']))
-
-                # cpe1, purl1 = external_ref_proc(pkg1['externalRefs'])
-                # cpe2, purl2 = external_ref_proc(pkg2['externalRefs'])
-                # cpe_score, purl_score = 0., 0.
-
-                dL_score = longest_common_substring_consistency_score(pkg1['downloadLocation'], pkg2['downloadLocation'])
-
-                # licenseC_score = license_consistency(pkg1['licenseConcluded'], pkg2['licenseConcluded'])
-                # licenseD_score = license_consistency(pkg1['licenseDeclared'], pkg2['licenseDeclared'])
-
-                if repo1_flag and repo2_flag:
-                    all_matched_scores['repo_info'] = [jaro(doc1['name'], doc2['name']), originator_score, supplier_score, copyright_score,
-                                                       version_score, PVC_score, dL_score]
-                    repo1_flag = False
-                    repo2_flag = False
-                else:
-                    result = [originator_score, supplier_score, copyright_score, version_score, PVC_score, dL_score]
-                    if any(x < 0 for x in result):
-                        with open(f'{result_path}/spdx-special-consistency.csv', 'a') as fd:
-                            writer = csv.writer(fd)
-                            writer.writerow(['spdx', tool1, tool2, reponame1, pkg1['name']] + result)
-                        all_matched_scores['pkg_info'].append([math.fabs(x) for x in result])
-                    else:
-                        all_matched_scores['pkg_info'].append(result)
+    matched1, matched2, repo_rows = [], [], []  # repo_rows: whether the matched pair gives the repo_info row
+    # positions of the packages in pkgs2 named after the repo, repo2_flag is raised once the scan passed one of them
+    repo_key = canonical_name(reponame1)
+    repo2_pos = [pos for pos, k2 in enumerate(pkgs_keys2) if item_key(pkgs2[k2], 'name', keyed=keyed[1]) == repo_key]
+    count('spdx.package_comparisons', len(pkgs1) * len(pkgs2))
+    with stage('match.join'):
+        for k1, k2, pos2 in join_by_name(pkgs1, pkgs2, 'name', join, keyed=keyed):
+            pkg1 = pkgs1[k1]
+            if item_key(pkg1, 'name', keyed=keyed[0]) == repo_key:
+                repo1_flag = True
+            if k2 is None:
+                repo2_flag = repo2_flag or bool(repo2_pos)
+                continue
+            repo2_flag = repo2_flag or (bool(repo2_pos) and repo2_pos[0] <= pos2)
+            matched1.append(pkg1)
+            matched2.append(pkgs2[k2])
+            matched_pkg.append(pkg1['name'])
+            if repo1_flag and repo2_flag:
+                repo_rows.append(True)
+                repo1_flag = False
+                # the rest of the scan over pkgs2 raises it again
+                repo2_flag = bool(repo2_pos) and repo2_pos[-1] > pos2
+            else:
+                repo_rows.append(False)
+                repo2_flag = repo2_flag or bool(repo2_pos)
+
+    # score all matched packages at once, the columns of SPDX_SCORES
+    # cpe1, purl1 = external_ref_proc(pkg1['externalRefs'])
+    # cpe2, purl2 = external_ref_proc(pkg2['externalRefs'])
+    # licenseC_score = license_consistency(pkg1['licenseConcluded'], pkg2['licenseConcluded'])
+    # licenseD_score = license_consistency(pkg1['licenseDeclared'], pkg2['licenseDeclared'])
+    scores = score_fields(matched1, matched2, SPDX_SCORES)
+    scores['packageVerificationCode'] = batch_scores([deal_PVC(pkg['packageVerificationCode']) for pkg in matched1],
+                                                     [deal_PVC(pkg['packageVerificationCode']) for pkg in matched2], equal_cmp)
+    columns = ['originator', 'supplier', 'copyrightText', 'versionInfo', 'packageVerificationCode', 'downloadLocation']
+    for pkg1, repo_row, result in zip(matched1, repo_rows, zip(*[scores[field] for field in columns])):
+        result = list(result)
+        if repo_row:
+            all_matched_scores['repo_info'] = [jaro(doc1['name'], doc2['name'])] + result
+        else:
+            if any(x < 0 for x in result):
+                all_matched_scores['special_info'].append(['spdx', tool1, tool2, reponame1, pkg1['name']] + result)
+                all_matched_scores['pkg_info'].append([math.fabs(x) for x in result])
+            else:
+                all_matched_scores['pkg_info'].append(result)
+            all_matched_scores['pkg_names'].append(pkg1['name'])
 
     if len(all_matched_scores['pkg_info']) == 0:
         all_matched_scores['pkg_info'].append([0, 0, 0, 0, 0, 0])
@@ -274,8 +381,31 @@ def match_spdx(file1_path, file2_path, result_path):
     return all_matched_scores
 
 
-def match_all(file1_path, file2_path, standard, result_path):
+def load_repo(standard, extract_path, reponame, tools):
+    # parse each {standard}#{tool}#{repo}.json once for all tool pairs, path -> (fileinfo, parse error)
+    # the documents of a packed extract_path are read from the ExtractedStore under the same paths
+    docs = {}
+    store = ExtractedStore(extract_path) if is_packed(extract_path) else None
+    for tool in tools:
+        path = os.path.join(extract_path, f'{standard}#{tool}#{reponame}.json')
+        try:
+            with stage('match.load'):
+                if store is None:
+                    docs[path] = (parse_fileinfo(path), None)
+                    count('match.bytes_read', os.path.getsize(path))
+                else:
+                    name = f'{standard}#{tool}#{reponame}'
+                    docs[path] = ((name, tool, reponame, store.get(name)), None)
+        except (OSError, ValueError, KeyError) as e:
+            docs[path] = (None, e)
+    if store is not None:
+        store.close()
+    return docs
+
+
+def match_all(file1_path, file2_path, standard, result_path, join='hash', docs=None):
     # global fileinvalid, TotalMatchedName
+    # docs: documents of the repo from load_repo, the files are read from disk without it
     filevalidflag = True
 
     if file1_path == file2_path:
@@ -283,48 +413,91 @@ def match_all(file1_path, file2_path, standard, result_path):
         filevalidflag = False
         # fileinvalid += 1
 
-    if not is_valid_json(file1_path):
-        logger.debug(f'[FileNotExistOrInvalid]: {file1_path}')
-        filevalidflag = False
-        # fileinvalid += 1
-
-    if not is_valid_json(file2_path):
-        logger.debug(f'[FileNotExistOrInvalid]: {file2_path}')
-        filevalidflag = False
-        # fileinvalid += 1
+    for file_path in [file1_path, file2_path]:
+        if docs is None:
+            valid = is_valid_json(file_path)
+        else:
+            valid = file_path in docs and docs[file_path][0] is not None
+        if not valid:
+            logger.debug(f'[FileNotExistOrInvalid]: {file_path}')
+            filevalidflag = False
+            # fileinvalid += 1
 
     if not filevalidflag:
         return None
 
+    file1, file2 = file1_path, file2_path
+    if docs is not None:
+        file1, file2 = docs[file1_path][0], docs[file2_path][0]
     if standard == 'spdx':
-        all_matched_scores = match_spdx(file1_path, file2_path, result_path)
+        all_matched_scores = match_spdx(file1, file2, result_path, join)
     elif standard == 'cdx':
-        all_matched_scores = match_cdx(file1_path, file2_path, result_path)
+        all_matched_scores = match_cdx(file1, file2, result_path, join)
     else:
         logger.error(f'Invalid standard: {standard}')
 
     return all_matched_scores
 
 
-def match(standard, extract_path, filenames, result_path):
+def consistency_row(standard, reponame, results):
+    # one row of {standard}-{tool1}-{tool2}-package-consistency.csv
+    if standard == 'cdx':
+        row = [reponame] + results['repo_info'] + results['statistic_info'] + \
+            [sum(x) / len(x) for x in zip(*results['pkg_info'])]
+    elif standard == 'spdx':
+        row = [reponame] + results['statistic_info'] + results['repo_info'] + \
+            [sum(x) / len(x) for x in zip(*results['pkg_info'])] + \
+            [sum(x) / len(x) for x in zip(*results['files_info'])]
+    return row
+
+
+def match_repo(task):
+    # the given tool pairs of one repo, returns [(tool1, tool2, consistency row, special rows, package rows)] of the valid pairs
+    # and the score cache counters and the measurements (profiling on) of the repo
+    standard, extract_path, reponame, tools, pairs, result_path, join, cache_size = task
+    start_time = time.perf_counter()
+    set_score_cache(cache_size)
+    cache_before = score_cache_stats()
+    docs = load_repo(standard, extract_path, reponame, tools)
+    matched = []
+    events = {}  # 'tool1|tool2' -> item event counts
+    take_item_events()
+    for tool1, tool2 in pairs:
+        filepath1 = os.path.join(extract_path, f'{standard}#{tool1}#{reponame}.json')
+        filepath2 = os.path.join(extract_path, f'{standard}#{tool2}#{reponame}.json')
+        results = match_all(filepath1, filepath2, standard, result_path, join, docs)
+        if results is not None:
+            pkg_rows = list(zip(results['pkg_names'], results['pkg_info']))
+            matched.append((tool1, tool2, consistency_row(standard, reponame, results), results['special_info'], pkg_rows))
+        pair_events = take_item_events()
+        if pair_events:
+            events[f'{tool1}|{tool2}'] = pair_events
+    if events:
+        # one record per repo, the counts are also in the extra of the record for structured sinks
+        logger.bind(item_events=events).info(f'[ItemEvents]: {standard}||{reponame}||{dumps_json(events, indent=False)}')
+    cache_stats = {name: [a - b for a, b in zip(stat, cache_before.get(name, [0, 0, 0.]))]
+                   for name, stat in score_cache_stats().items()}
+    repo_time(f'{standard}#{reponame}', time.perf_counter() - start_time)
+    return matched, cache_stats, take_metrics()
+
+
+def match(standard, extract_path, filenames, result_path, join='hash', jobs=1, store=None, manifest=None,
+          cache_size=SCORE_CACHE_SIZE, profile=None):
+    # join: 'hash' matches names through an index, 'nested' is the original pairwise scan
+    # jobs: number of processes for the repos, rows keep the serial order
+    # store: a ScoreStore that gets the CSV rows and the scores of every matched package
+    # extract_path: directory of the extracted JSON files, or the ExtractedStore file (*.db) of extract()
+    # manifest: a RunManifest, only the (repo, tool1, tool2) units whose extracted files changed are redone
+    #           and their rows replaced in the existing CSVs
+    # cache_size: value pairs memoized per scorer and process, 0 turns the score cache off
+    # profile: directory of the stage profile reports (JSON and Prometheus textfile), SAP_PROFILE sets it as well
     tools_spdx = ['syft', 'gh-sbom', 'sbom-tool', 'ort']
     tools_cdx = ['syft', 'gh-sbom', 'scancode', 'cdxgen']
     print(standard, extract_path, filenames, result_path)
+    if profile:
+        enable_profiling(profile)
+    run_start = time.perf_counter()
     special = os.path.join(result_path, standard + '-special-consistency.csv')
-    with open(special, 'w', newline='') as fd:
-        writer = csv.writer(fd)
-        if standard == 'cdx':
-            writer.writerow([
-                'standard', 'tool1', 'tool2', 'repo_name', 'pkg_name',
-                'author_score', 'type_score', 'purl_score', 'cpe_score', 'version_score'
-            ])
-        elif standard == 'spdx':
-            # ['spdx', tool1, tool2, reponame1, pkg1['name']] + result + [neg_cpe, neg_purl]
-            writer.writerow([
-                'standard', 'tool1', 'tool2', 'repo_name', 'pkg_name',
-                # below are for pkgs
-                'originator_score', 'supplier_score', 'copyright_score', 'version_score', 'PVC_score', 'dL_score'
-            ])
     if standard == 'spdx':
         tools = tools_spdx
     elif standard == 'cdx':
@@ -332,50 +505,98 @@ def match(standard, extract_path, filenames, result_path):
     else:
         logger.error(f'Invalid standard: {standard}')
         return
-    for i in range(len(tools)):
-        for j in range(i+1, len(tools)):
-            tool1 = tools[i]
-            tool2 = tools[j]
-            wbfile = os.path.join(result_path, f'{standard}-{tool1}-{tool2}-package-consistency.csv')
+    pairs = [(tools[i], tools[j]) for i in range(len(tools)) for j in range(i+1, len(tools))]
+    pair_files = {(tool1, tool2): os.path.join(result_path, f'{standard}-{tool1}-{tool2}-package-consistency.csv')
+                  for tool1, tool2 in pairs}
+    units = manifest.units(standard) if manifest is not None else {}
+    resume = manifest is not None and all(os.path.exists(f) for f in [special] + list(pair_files.values()))
+    if store is not None:
+        store.create(standard, PAIR_COLUMNS[standard], SPECIAL_COLUMNS[standard][5:])
+    if not resume:
+        units.clear()
+        with open(special, 'w', newline='') as fd:
+            writer = csv.writer(fd)
+            writer.writerow(SPECIAL_COLUMNS[standard])
+        for wbfile in pair_files.values():
             with open(wbfile, 'w', newline='') as fd:
                 writer = csv.writer(fd)
-                if standard == 'cdx':
-                    writer.writerow([
-                        'repo_name', 'repo_name_meta', 'repo_version', 'comp_num1', 'comp_num2', 'matched_comps',
-                        'author_score', 'type_score', 'purl_score', 'cpe_score', 'version_score'
-                    ])
-                elif standard == 'spdx':
-                    writer.writerow([
-                        'repo_name', 'files_num1', 'files_num2', 'matched_files', 'pkgs_num1', 'pkgs_num2', 'matched_pkgs',
-                        # repo info
-                        'doc_name', 'originator_score_r', 'supplier_score_r', 'copyright_score_r', 'version_score_r', 'PVC_score_r', 'dL_score_r',
-                        # pkg info
-                        'originator_score', 'supplier_score', 'copyright_score', 'version_score', 'PVC_score', 'dL_score',
-                        # file info
-                        'checksum_score'
-                    ])
+                writer.writerow(PAIR_COLUMNS[standard])
+        if store is not None:
+            store.clear(standard)
     with open(filenames, 'r') as fd:
-        line = fd.readline()
-        while (line):
-            line = line.strip()
-            for i in range(len(tools)):
-                tool1 = tools[i]
-                filepath1 = os.path.join(extract_path, f'{standard}#{tool1}#{line}.json')
-                for j in range(i+1, len(tools)):
-                    tool2 = tools[j]
-                    filepath2 = os.path.join(extract_path, f'{standard}#{tool2}#{line}.json')
-                    results = match_all(filepath1, filepath2, standard, result_path)
-                    if results is not None:
-                        if standard == 'cdx':
-                            row = [line] + results['repo_info'] + results['statistic_info'] + \
-                                [sum(x) / len(x) for x in zip(*results['pkg_info'])]
-                        elif standard == 'spdx':
-                            row = [line] + results['statistic_info'] + results['repo_info'] + \
-                                [sum(x) / len(x) for x in zip(*results['pkg_info'])] + \
-                                [sum(x) / len(x) for x in zip(*results['files_info'])]
-                        wbfile = os.path.join(result_path, f'{standard}-{tool1}-{tool2}-package-consistency.csv')
-                        write_row2csv(wbfile, row)
-            line = fd.readline()
+        reponames = [line.strip() for line in fd]
+    # list the extracted directory once, tools without a file for the repo are not loaded
+    if is_packed(extract_path):
+        with ExtractedStore(extract_path) as extracted:
+            packed_hashes = extracted.hashes(standard)
+        listing = {name + '.json' for name in packed_hashes}
+    else:
+        packed_hashes = None
+        listing = set(os.listdir(extract_path))
+    tasks = []
+    unit_hashes = {}  # repo -> tool -> hash of its extracted file
+    for reponame in reponames:
+        present = [t for t in tools if f'{standard}#{t}#{reponame}.json' in listing]
+        if manifest is None:
+            tasks.append((standard, extract_path, reponame, present,
+                          [(t1, t2) for t1, t2 in pairs if t1 in present and t2 in present], result_path, join, cache_size))
+            continue
+        if packed_hashes is not None:
+            hashes = {t: packed_hashes.get(f'{standard}#{t}#{reponame}') for t in tools}
+        else:
+            hashes = {t: manifest.content_hash('extracted', f'{standard}#{t}#{reponame}.json',
+                                               os.path.join(extract_path, f'{standard}#{t}#{reponame}.json'), refresh=True)
+                      if t in present else None for t in tools}
+        done = units.get(reponame, {})
+        redo = [(t1, t2) for t1, t2 in pairs if done.get(f'{t1}|{t2}') != [hashes[t1], hashes[t2]]]
+        if redo:
+            unit_hashes[reponame] = hashes
+            tasks.append((standard, extract_path, reponame, [t for t in present if any(t in p for p in redo)], redo,
+                          result_path, join, cache_size))
+    if resume:
+        # drop the rows of the units that are redone, the new rows are appended
+        redo_units = {(t1, t2, task[2]) for task in tasks for t1, t2 in task[4]}
+        dropped = drop_rows(special, lambda row: (row[1], row[2], row[3]) in redo_units)
+        for (tool1, tool2), wbfile in pair_files.items():
+            dropped += drop_rows(wbfile, lambda row: (tool1, tool2, row[0]) in redo_units)
+        if store is not None:
+            for tool1, tool2, reponame in redo_units:
+                store.clear(standard, tool1, tool2, reponame)
+        logger.info(f'[Resume]: {standard}||{len(redo_units)} units to redo||{dropped} rows dropped')
+    cache_stats = {}
+    with ResultSink() as sink:
+        for n, (task, (matched, repo_cache_stats, repo_metrics)) in enumerate(zip(tasks, run_tasks(match_repo, tasks, jobs))):
+            for name, stat in repo_cache_stats.items():
+                cache_stats[name] = [a + b for a, b in zip(cache_stats.get(name, [0, 0, 0.]), stat)]
+            if repo_metrics is not None:
+                metrics.add(repo_metrics)
+            with stage('match.write'):
+                for tool1, tool2, row, special_rows, pkg_rows in matched:
+                    for special_row in special_rows:
+                        sink.write_row(special, special_row)
+                    sink.write_row(pair_files[(tool1, tool2)], row)
+                    if store is not None:
+                        store.add_repo(standard, tool1, tool2, row)
+                        store.add_packages(standard, tool1, tool2, row[0], pkg_rows)
+            if manifest is not None:
+                reponame, hashes = task[2], unit_hashes[task[2]]
+                units.setdefault(reponame, {}).update({f'{t1}|{t2}': [hashes[t1], hashes[t2]] for t1, t2 in task[4]})
+                if (n + 1) % 100 == 0:
+                    # checkpoint: the rows are on disk before the units are marked as done
+                    sink.flush()
+                    if store is not None:
+                        store.commit()
+                    manifest.save()
+    if manifest is not None:
+        if store is not None:
+            store.commit()
+        manifest.save()
+    for name, (hits, misses, miss_time) in cache_stats.items():
+        # a hit saves the mean time of a miss
+        saved = hits * miss_time / misses if misses else 0.
+        logger.info(f'[ScoreCache]: {standard}||{name}||hit rate {hits / max(hits + misses, 1):.1%}||'
+                    f'{hits}/{hits + misses}||saved {saved:.3f}s')
+    write_report(f'match-{standard}', time.perf_counter() - run_start)
 
 
 if __name__ == '__main__':
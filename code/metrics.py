@@ -0,0 +1,125 @@
+import os
+import resource
+import time
+from contextlib import contextmanager, nullcontext
+from loguru import logger
+from .utils import dumps_json
+
+# stage profiling of extract() and match(), off unless SAP_PROFILE names the directory of the reports
+# (or enable_profiling is called). When off, stage() is a shared no-op context and count() returns at once
+_OFF = nullcontext()
+
+
+class Metrics:
+    # the measurements of one process:
+    #   stages:   stage -> [calls, wall seconds, cpu seconds]
+    #   counters: name -> count, e.g. comparisons or bytes read
+    #   repos:    {standard}#{repo} -> wall seconds
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.repos = {}
+
+    def add(self, data: dict) -> None:
+        # merge the take() of another process
+        for name, (calls, wall, cpu) in data['stages'].items():
+            stage = self.stages.setdefault(name, [0, 0., 0.])
+            stage[0] += calls
+            stage[1] += wall
+            stage[2] += cpu
+        for name, value in data['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        self.repos.update(data['repos'])
+
+    def take(self) -> dict:
+        # the measurements since the last take, cleared
+        data = {'stages': self.stages, 'counters': self.counters, 'repos': self.repos}
+        self.__init__()
+        return data
+
+
+metrics = Metrics()
+profile_path = os.environ.get('SAP_PROFILE') or None
+
+
+def enable_profiling(path: str) -> None:
+    # write the reports to the directory path, None turns profiling off.
+    # the environment carries it to worker processes that are spawned rather than forked
+    global profile_path
+    profile_path = path
+    if path:
+        os.environ['SAP_PROFILE'] = path
+    else:
+        os.environ.pop('SAP_PROFILE', None)
+
+
+@contextmanager
+def _timed(name):
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        stage = metrics.stages.setdefault(name, [0, 0., 0.])
+        stage[0] += 1
+        stage[1] += time.perf_counter() - wall
+        stage[2] += time.process_time() - cpu
+
+
+def stage(name: str):
+    # with stage('match.join'): ... adds the wall and CPU time of the block to the stage
+    return _timed(name) if profile_path else _OFF
+
+
+def count(name: str, value: int = 1) -> None:
+    if profile_path:
+        metrics.counters[name] = metrics.counters.get(name, 0) + value
+
+
+def repo_time(key: str, seconds: float) -> None:
+    if profile_path:
+        metrics.repos[key] = seconds
+
+
+def take_metrics():
+    # the measurements of this process for the parent, None when profiling is off
+    return metrics.take() if profile_path else None
+
+
+def peak_rss() -> dict:
+    # peak resident set size in bytes of this process and of its finished workers (ru_maxrss is in KB on Linux)
+    return {who: resource.getrusage(usage).ru_maxrss * 1024
+            for who, usage in [('self', resource.RUSAGE_SELF), ('children', resource.RUSAGE_CHILDREN)]}
+
+
+def prometheus_text(run: str, data: dict, rss: dict) -> str:
+    lines = ['# HELP sap_stage_calls_total Calls of a pipeline stage.', '# TYPE sap_stage_calls_total counter']
+    lines += [f'sap_stage_calls_total{{run="{run}",stage="{name}"}} {calls}' for name, (calls, _, _) in data['stages'].items()]
+    lines += ['# HELP sap_stage_seconds_total Time spent in a pipeline stage.', '# TYPE sap_stage_seconds_total counter']
+    for name, (_, wall, cpu) in data['stages'].items():
+        lines.append(f'sap_stage_seconds_total{{run="{run}",stage="{name}",clock="wall"}} {wall:.6f}')
+        lines.append(f'sap_stage_seconds_total{{run="{run}",stage="{name}",clock="cpu"}} {cpu:.6f}')
+    lines += ['# HELP sap_count_total Comparisons and bytes of the run.', '# TYPE sap_count_total counter']
+    lines += [f'sap_count_total{{run="{run}",name="{name}"}} {value}' for name, value in data['counters'].items()]
+    lines += ['# HELP sap_peak_rss_bytes Peak resident set size.', '# TYPE sap_peak_rss_bytes gauge']
+    lines += [f'sap_peak_rss_bytes{{run="{run}",process="{who}"}} {value}' for who, value in rss.items()]
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(run: str, wall: float) -> None:
+    # {run}-profile.json and {run}.prom (for the node exporter textfile collector) of the measurements so far,
+    # which are cleared; run: e.g. extract, match-cdx
+    if not profile_path:
+        return
+    os.makedirs(profile_path, exist_ok=True)
+    data, rss = metrics.take(), peak_rss()
+    report = dict(data, run=run, wall=wall, peak_rss=rss)
+    json_path = os.path.join(profile_path, f'{run}-profile.json')
+    with open(json_path, 'w') as f:
+        f.write(dumps_json(report))
+    # write aside and rename, the collector never reads a partial file
+    prom_path = os.path.join(profile_path, f'{run}.prom')
+    with open(prom_path + '.tmp', 'w') as f:
+        f.write(prometheus_text(run, data, rss))
+    os.replace(prom_path + '.tmp', prom_path)
+    slowest = sorted(data['stages'].items(), key=lambda item: -item[1][1])[:5]
+    logger.info(f'[Profile]: {run}||{wall:.3f}s||' + ', '.join(f'{name} {s[1]:.3f}s' for name, s in slowest) + f'||{json_path}')
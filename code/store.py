@@ -0,0 +1,152 @@
+import csv
+import hashlib
+import sqlite3
+import zlib
+from loguru import logger
+from .utils import dumps_json, loads_json
+
+# per-pair means as in results/consistency-{ecosystem}/{standard}-package-consistency.csv:
+# the package counts become the ratio matched / max(num1, num2), the file counts are left out
+SUMMARY_RATIO = {
+    'cdx': ('comp_num1', 'comp_num2', 'matched_comps'),
+    'spdx': ('pkgs_num1', 'pkgs_num2', 'matched_pkgs')
+}
+SUMMARY_SKIP = ['repo_name', 'files_num1', 'files_num2', 'matched_files']
+
+
+class ScoreStore:
+    # consistency scores of match() in indexed SQLite tables, next to the CSVs:
+    # {standard}_repo holds the rows of the package-consistency CSVs, {standard}_pkg one row per matched package
+    def __init__(self, db_path: str, ecosystem: str):
+        self.conn = sqlite3.connect(db_path)
+        self.ecosystem = ecosystem
+
+    def create(self, standard: str, pair_columns: list, pkg_columns: list) -> None:
+        pair_columns = ', '.join(f'"{c}"' for c in pair_columns)
+        pkg_columns = ', '.join(f'"{c}" REAL' for c in pkg_columns)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {standard}_repo (ecosystem TEXT, tool1 TEXT, tool2 TEXT, {pair_columns})')
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS {standard}_repo_pair ON {standard}_repo (ecosystem, tool1, tool2)')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {standard}_pkg '
+                          f'(ecosystem TEXT, tool1 TEXT, tool2 TEXT, repo_name TEXT, pkg_name TEXT, {pkg_columns})')
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS {standard}_pkg_pair ON {standard}_pkg (ecosystem, tool1, tool2, repo_name)')
+
+    def clear(self, standard: str, tool1: str = None, tool2: str = None, reponame: str = None) -> None:
+        # drop the rows of this ecosystem, optionally only those of one tool pair / repo
+        where, args = 'ecosystem = ?', [self.ecosystem]
+        for column, value in [('tool1', tool1), ('tool2', tool2), ('repo_name', reponame)]:
+            if value is not None:
+                where += f' AND {column} = ?'
+                args.append(value)
+        for table in [f'{standard}_repo', f'{standard}_pkg']:
+            self.conn.execute(f'DELETE FROM {table} WHERE {where}', args)
+
+    def add_repo(self, standard: str, tool1: str, tool2: str, row: list) -> None:
+        marks = ', '.join('?' * (len(row) + 3))
+        self.conn.execute(f'INSERT INTO {standard}_repo VALUES ({marks})', [self.ecosystem, tool1, tool2] + row)
+
+    def add_packages(self, standard: str, tool1: str, tool2: str, reponame: str, pkg_rows: list) -> None:
+        if not pkg_rows:
+            return
+        marks = ', '.join('?' * (len(pkg_rows[0][1]) + 5))
+        self.conn.executemany(f'INSERT INTO {standard}_pkg VALUES ({marks})',
+                              [[self.ecosystem, tool1, tool2, reponame, name] + scores for name, scores in pkg_rows])
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ExtractedStore:
+    # the documents of extract() packed into one SQLite file instead of one indented JSON file per SBOM:
+    # one row per {standard}#{tool}#{repo} with the zlib-compressed compact JSON and its content hash
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS extracted '
+                          '(name TEXT PRIMARY KEY, standard TEXT, tool TEXT, repo TEXT, hash TEXT, data BLOB)')
+
+    @staticmethod
+    def pack(data: dict) -> bytes:
+        return zlib.compress(dumps_json(data, indent=False).encode('utf-8'))
+
+    def put(self, name: str, blob: bytes) -> None:
+        # name: the extracted file name without .json, e.g. cdx#syft#repo
+        standard, tool, repo = name.split('#')
+        self.conn.execute('INSERT OR REPLACE INTO extracted VALUES (?, ?, ?, ?, ?, ?)',
+                          [name, standard, tool, repo, hashlib.blake2b(blob, digest_size=20).hexdigest(), blob])
+
+    def get(self, name: str) -> dict:
+        row = self.conn.execute('SELECT data FROM extracted WHERE name = ?', [name]).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return loads_json(zlib.decompress(row[0]))
+
+    def hashes(self, standard: str = None) -> dict:
+        # name -> content hash, of one standard or of all
+        if standard is None:
+            return dict(self.conn.execute('SELECT name, hash FROM extracted'))
+        return dict(self.conn.execute('SELECT name, hash FROM extracted WHERE standard = ?', [standard]))
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_packed(extract_path: str) -> bool:
+    # extract_path names an ExtractedStore file rather than a directory of extracted JSON files
+    return extract_path.endswith('.db')
+
+
+def pair_means(db_path: str, standard: str, ecosystem: str):
+    # header and rows of the per-tool-pair mean table, pairs in the order match() stored them
+    conn = sqlite3.connect(db_path)
+    columns = [c[1] for c in conn.execute(f'PRAGMA table_info({standard}_repo)')][3:]
+    num1, num2, matched = SUMMARY_RATIO[standard]
+    header, selects = ['tools'], ["tool1 || '+' || tool2"]
+    for c in columns:
+        if c in SUMMARY_SKIP or c in (num1, num2):
+            continue
+        header.append(c)
+        if c == matched:
+            selects.append(f'ROUND(AVG(CASE WHEN MAX("{num1}", "{num2}") > 0 '
+                           f'THEN "{matched}" * 1.0 / MAX("{num1}", "{num2}") ELSE 0 END), 4)')
+        else:
+            selects.append(f'ROUND(AVG("{c}"), 4)')
+    rows = conn.execute(f'SELECT {", ".join(selects)} FROM {standard}_repo WHERE ecosystem = ? '
+                        f'GROUP BY tool1, tool2 ORDER BY MIN(rowid)', [ecosystem]).fetchall()
+    conn.close()
+    return header, rows
+
+
+def write_pair_means(db_path: str, standard: str, ecosystem: str, csv_path: str) -> None:
+    header, rows = pair_means(db_path, standard, ecosystem)
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    logger.info(f'[PairMeans]: {standard}||{ecosystem}||{csv_path}')
+
+
+if __name__ == '__main__':
+    db_path = 'results/matched/scores.db'
+
+    for ecosystem in ['python', 'java', 'c-cpp']:
+        for standard in ['cdx', 'spdx']:
+            write_pair_means(db_path, standard, ecosystem, f'results/matched/{ecosystem}-{standard}-package-consistency.csv')
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import random
+from .utils import dumps_json
+
+# offline generator of SBOM corpora shaped like the outputs of the tools, for benchmarks at any size:
+# the repos of a corpus share a pool of dependency names, each tool reports an overlapping share of them
+# with its own naming, version and purl habits, and the SPDX tools add a files section
+SPDX_TOOLS = ['syft', 'gh-sbom', 'sbom-tool']
+CDX_TOOLS = ['syft', 'gh-sbom', 'scancode', 'cdxgen']
+ECOSYSTEMS = ['pypi', 'maven', 'npm', 'golang']
+PEOPLE = ['Person: Jane Doe', 'Person: John Smith', 'Organization: Python Software Foundation',
+          'Organization: Apache Software Foundation', 'NOASSERTION', '']
+
+
+def tool_name(tool, name, ecosystem):
+    # gh-sbom names packages after the dependency graph, e.g. pip:requests
+    if tool == 'gh-sbom':
+        return {'pypi': 'pip:', 'npm': 'npm:', 'maven': 'maven:', 'golang': 'go:'}[ecosystem] + name
+    return name
+
+
+def noisy_version(rng, version, noise):
+    if rng.random() >= noise:
+        return version
+    return rng.choice(['v' + version, '>=' + version, version.rsplit('.', 1)[0], 'NOASSERTION', ''])
+
+
+def purl(rng, ecosystem, name, version, noise):
+    value = f'pkg:{ecosystem}/{name}@{version}'
+    if rng.random() < noise:
+        value += rng.choice(['?type=jar', '#subpath', '?arch=x86_64'])
+    return value
+
+
+def pick_packages(rng, pool, packages, overlap):
+    # packages of one tool: a share overlap of the repo's pool, the rest names no other tool reports
+    shared = rng.sample(pool, min(len(pool), int(packages * overlap)))
+    own = [(f'{name}-{rng.randrange(10 ** 6)}', ecosystem, version)
+           for name, ecosystem, version in rng.sample(pool, min(len(pool), packages - len(shared)))]
+    return shared + own
+
+
+def spdx_document(rng, tool, reponame, packages, files, noise):
+    doc = {
+        'SPDXID': 'SPDXRef-DOCUMENT',
+        'name': reponame if tool != 'gh-sbom' else f'com.github.{reponame}',
+        'spdxVersion': 'SPDX-2.3',
+        'dataLicense': 'CC0-1.0',
+        'documentNamespace': f'https://spdx.org/spdxdocs/{tool}/{reponame}-{rng.randrange(10 ** 9)}',
+        'creationInfo': {'creators': [f'Tool: {tool}'], 'created': '2024-06-01T00:00:00Z'},
+        'packages': []
+    }
+    for i, (name, ecosystem, version) in enumerate([(reponame, 'pypi', '1.0.0')] + packages):
+        doc['packages'].append({
+            'name': tool_name(tool, name, ecosystem),
+            'SPDXID': f'SPDXRef-Package-{i}',
+            'versionInfo': noisy_version(rng, version, noise),
+            'downloadLocation': rng.choice([f'https://github.com/{name}/{name}', f'git+https://github.com/{name}/{name}.git',
+                                            'NOASSERTION']),
+            'supplier': rng.choice(PEOPLE),
+            'originator': rng.choice(PEOPLE),
+            'copyrightText': rng.choice(['NOASSERTION', f'Copyright {name} authors']),
+            'packageVerificationCode': {'packageVerificationCodeValue': hashlib.sha1(name.encode()).hexdigest()},
+            'externalRefs': [{'referenceCategory': 'PACKAGE-MANAGER', 'referenceType': 'purl',
+                              'referenceLocator': purl(rng, ecosystem, name, version, noise)}]
+        })
+    if tool == 'gh-sbom':  # the dependency graph has no files
+        return doc
+    doc['files'] = []
+    for i in range(files):
+        path = f'src/module{i % 50}/file{i}.py'
+        content = f'{reponame}/{path}'.encode()
+        checksums = [{'algorithm': 'SHA1', 'checksumValue': hashlib.sha1(content).hexdigest()}]
+        if tool == 'sbom-tool':
+            checksums.append({'algorithm': 'SHA256', 'checksumValue': hashlib.sha256(content).hexdigest()})
+        if rng.random() < noise:
+            checksums[0]['checksumValue'] = 'NOASSERTION'
+        doc['files'].append({'fileName': ('./' if tool == 'syft' else '/') + path, 'SPDXID': f'SPDXRef-File-{i}',
+                             'checksums': checksums})
+    return doc
+
+
+def cdx_document(rng, tool, reponame, packages, noise):
+    doc = {
+        'bomFormat': 'CycloneDX',
+        'specVersion': '1.5',
+        'serialNumber': f'urn:uuid:{rng.randrange(16 ** 32):032x}',
+        'version': 1,
+        'metadata': {'timestamp': '2024-06-01T00:00:00Z', 'tools': [{'name': tool}],
+                     'component': {'name': reponame, 'version': '1.0.0', 'bom-ref': reponame}},
+        'components': []
+    }
+    for name, ecosystem, version in packages:
+        version = noisy_version(rng, version, noise)
+        component = {'name': tool_name(tool, name, ecosystem), 'version': version, 'type': 'library',
+                     'bom-ref': f'{name}@{version}', 'purl': purl(rng, ecosystem, name, version, noise)}
+        if tool in ('scancode', 'cdxgen'):
+            component['author'] = rng.choice(PEOPLE)
+        if tool == 'syft':
+            component['cpe'] = f'cpe:2.3:a:{name}:{name}:{version}:*:*:*:*:*:*:*'
+        doc['components'].append(component)
+    return doc
+
+
+def generate_corpus(out_path, repos=10, packages=100, files=100, overlap=0.8, noise=0.1, seed=0):
+    # write {standard}#{tool}#{repo}.json of every tool for repos repos with packages packages and files files each,
+    # and the names.txt / filenames.txt lists of extract() and match().
+    # overlap: share of a tool's packages also reported by the other tools, noise: share of altered versions and purls
+    rng = random.Random(seed)
+    os.makedirs(out_path, exist_ok=True)
+    names = [f'lib{rng.choice("abcdefgh")}{i}' for i in range(max(packages * 4, 100))]
+    reponames, filenames = [], []
+    for r in range(repos):
+        reponame = f'synthetic-repo{r}'
+        reponames.append(reponame)
+        pool = [(name, rng.choice(ECOSYSTEMS), f'{rng.randrange(5)}.{rng.randrange(20)}.{rng.randrange(10)}')
+                for name in rng.sample(names, packages)]
+        for standard, tools in [('spdx', SPDX_TOOLS), ('cdx', CDX_TOOLS)]:
+            for tool in tools:
+                chosen = pick_packages(rng, pool, packages, overlap)
+                if standard == 'spdx':
+                    doc = spdx_document(rng, tool, reponame, chosen, files, noise)
+                else:
+                    doc = cdx_document(rng, tool, reponame, chosen, noise)
+                filename = f'{standard}#{tool}#{reponame}.json'
+                with open(os.path.join(out_path, filename), 'w') as f:
+                    f.write(dumps_json(doc, indent=False))
+                filenames.append(filename)
+    for listname, lines in [('names.txt', reponames), ('filenames.txt', filenames)]:
+        with open(os.path.join(out_path, listname), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return os.path.join(out_path, 'names.txt'), os.path.join(out_path, 'filenames.txt')
+
+
+if __name__ == '__main__':
+    generate_corpus('results/synthetic', repos=10, packages=200, files=200)
@@ -1,16 +1,258 @@
 import json
 import os
 import csv
+import gzip
+import re
+import threading
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+from loguru import logger
+
+# optional faster JSON backends, the stdlib json module is the fallback.
+# SAP_JSON_BACKEND=json forces the stdlib for both reads and writes
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+# optional event parser for the streaming extraction
+try:
+    import ijson
+except ImportError:
+    ijson = None
+# optional decompressor for .zst inputs
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_BACKEND = os.environ.get('SAP_JSON_BACKEND') or ('orjson' if orjson else 'simdjson' if simdjson else 'json')
+
+# per-item events of the hot loops (one per package or file) are counted per process, and logged one by one
+# only with SAP_ITEM_LOG=1: the message is joined from its parts then, and never built otherwise
+ITEM_LOG = os.environ.get('SAP_ITEM_LOG') == '1'
+item_events = Counter()
+
+
+def item_event(tag, level, *parts):
+    item_events[tag] += 1
+    if ITEM_LOG:
+        logger.opt(depth=1).log(level, f'[{tag}]: ' + '||'.join(str(part) for part in parts))
+
+
+def take_item_events() -> dict:
+    # tag -> count since the last call
+    events = dict(item_events)
+    item_events.clear()
+    return events
+
+
+# id of the name normalization below, stored in extracted files next to the precomputed match keys.
+# bump it whenever canonical_name or deal_filename change so that stale keys are recomputed
+NAME_SCHEME = 'name-v1'
+NAME_PREFIXES = re.compile("npm:|pip:|go:|actions:|composer:|rust:|ruby:|nuget:|rubygems:|docker:|maven:| ")
+
+
+def canonical_name(name):
+    # fix encoding problem, then remove prefixes
+    return NAME_PREFIXES.sub('', unquote(name)).lower()
+
+
+def keep_name(name):
+    return name
+
+
+def deal_filename(name):
+    # deal with filenames in Files Section
+    if name.startswith('./'):
+        name = name[2:]
+    elif name.startswith('/'):
+        name = name[1:]
+    return name
+
+
+def loads_json(data: bytes):
+    # decode errors of every backend are ValueErrors (JSONDecodeError, UnicodeDecodeError)
+    if JSON_BACKEND == 'orjson':
+        return orjson.loads(data)
+    if JSON_BACKEND == 'simdjson':
+        return simdjson.loads(data)
+    return json.loads(data)
+
+
+def load_json(file_path):
+    with open(file_path, 'rb') as f:
+        return loads_json(f.read())
+
+
+def _skip_value(events, event):
+    # consume the rest of a value that started with event
+    if event not in ('start_map', 'start_array'):
+        return
+    depth = 1
+    for _, event, _ in events:
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def _build_value(events, event, value):
+    # the whole value that started with event
+    if event not in ('start_map', 'start_array'):
+        return value
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+    depth = 1
+    for _, event, value in events:
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+            if depth == 0:
+                return builder.value
+
+
+def _build_fields(events, fields):
+    # the wanted fields of a map whose start_map was consumed, the other fields are skipped unbuilt
+    result = {}
+    for _, event, key in events:
+        if event == 'end_map':
+            return result
+        _, event, value = next(events)
+        if key in fields:
+            result[key] = _build_value(events, event, value)
+        else:
+            _skip_value(events, event)
+
+
+def stream_json(file_path, top_keys, array_fields):
+    # walk a document event by event and keep only
+    #   top_keys:     top-level fields, kept whole
+    #   array_fields: top-level array -> fields kept of each of its objects
+    # the peak memory is the kept data plus one array element, whatever the size of the input.
+    # file_path may also be an open binary file, e.g. of SBOMSource.open.
+    # decode errors are ValueErrors as for load_json
+    with open(file_path, 'rb') if isinstance(file_path, str) else file_path as f:
+        events = ijson.parse(f, use_float=True)
+        try:
+            _, event, _ = next(events)
+            if event != 'start_map':
+                raise ValueError(f'not a JSON object: {file_path}')
+            doc = {}
+            for _, event, key in events:
+                if event == 'end_map':
+                    break
+                _, event, value = next(events)
+                if key in array_fields and event == 'start_array':
+                    doc[key] = []
+                    for _, event, value in events:
+                        if event == 'end_array':
+                            break
+                        if event == 'start_map':
+                            doc[key].append(_build_fields(events, array_fields[key]))
+                        else:
+                            _skip_value(events, event)
+                elif key in top_keys:
+                    doc[key] = _build_value(events, event, value)
+                else:
+                    _skip_value(events, event)
+        except (ijson.JSONError, StopIteration) as e:
+            raise ValueError(f'{e}: {file_path}')
+    return doc
+
+
+# errors of reading a compressed input, besides the JSON decode errors
+DECOMPRESS_ERRORS = (OSError, EOFError, zipfile.BadZipFile) + ((zstandard.ZstdError,) if zstandard else ())
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+
+
+class SBOMSource:
+    # the input SBOMs of extract() by the names of the filelist, read in place from
+    # a directory or a zip archive such as all-sboms.zip. A name is also found as name.gz / name.zst.
+    # use sbom_source(), it keeps one per process
+    def __init__(self, path: str):
+        self.path = path
+        self.archive = None
+        if os.path.isfile(path) and zipfile.is_zipfile(path):
+            self.archive = zipfile.ZipFile(path)
+            # central directory by member base name, the SBOMs may sit under a folder of the archive
+            self.members = {os.path.basename(info.filename): info for info in self.archive.infolist() if not info.is_dir()}
+
+    def resolve(self, name: str):
+        # stored name of the input, None when it is missing
+        for stored in [name] + [name + suffix for suffix in COMPRESSED_SUFFIXES]:
+            if self.archive is not None and stored in self.members:
+                return stored
+            if self.archive is None and os.path.exists(os.path.join(self.path, stored)):
+                return stored
+        return None
+
+    def size(self, stored: str) -> int:
+        if self.archive is not None:
+            return self.members[stored].file_size
+        return os.path.getsize(os.path.join(self.path, stored))
+
+    def fingerprint(self, stored: str):
+        # content hash of an archive member from the central directory, None for files of a directory
+        if self.archive is None:
+            return None
+        info = self.members[stored]
+        return f'crc32-{info.CRC:08x}-{info.file_size}'
+
+    def open(self, stored: str):
+        # binary file of the decompressed input
+        if self.archive is not None:
+            f = self.archive.open(self.members[stored])
+        else:
+            f = open(os.path.join(self.path, stored), 'rb')
+        if stored.endswith('.gz'):
+            return gzip.GzipFile(fileobj=f)
+        if stored.endswith('.zst'):
+            return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+        return f
+
+    def read(self, stored: str) -> bytes:
+        with self.open(stored) as f:
+            return f.read()
+
+
+_sources = {}
+
+
+def sbom_source(path: str) -> SBOMSource:
+    # the SBOMSource of path for this process, an archive is indexed once and never shared with forked workers
+    key = (path, os.getpid())
+    if key not in _sources:
+        _sources[key] = SBOMSource(path)
+    return _sources[key]
+
+
+def dumps_json(data, indent=True) -> str:
+    # indent=False: compact, without whitespace
+    if JSON_BACKEND == 'orjson':
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, option=option).decode('utf-8')
+    if not indent:
+        return json.dumps(data, separators=(',', ':'))
+    return json.dumps(data, indent=4)
 
 
 def is_valid_json(file_path):
     if not os.path.exists(file_path):
         return False
     try:
-        with open(file_path, 'r') as f:
-            json.load(f)
+        load_json(file_path)
         return True
-    except (json.JSONDecodeError, UnicodeDecodeError, json.decoder.JSONDecodeError):
+    except ValueError:
         return False
 
 
@@ -24,8 +266,7 @@ def parse_fileinfo(path):  # parse from extracted file by extract.py
     string = os.path.basename(path)
     filename = string[:string.rfind(".")]
     _, tool, reponame = filename.split('#')
-    with open(path, 'r') as file:
-        data = json.load(file)
+    data = load_json(path)
     return filename, tool, reponame, data
 
 
@@ -33,3 +274,70 @@ def write_row2csv(filename: str, data: list) -> None:
     with open(filename, 'a', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(data)
+
+
+def drop_rows(filename: str, drop) -> int:
+    # rewrite a result CSV without the rows for which drop(row) is true, the header is kept
+    with open(filename, 'r', newline='') as f:
+        rows = list(csv.reader(f))
+    kept = rows[:1] + [row for row in rows[1:] if not drop(row)]
+    if len(kept) < len(rows):
+        with open(filename, 'w', newline='') as f:
+            csv.writer(f).writerows(kept)
+    return len(rows) - len(kept)
+
+
+class ResultSink:
+    # keeps the result CSVs open and appends their rows in batches, same bytes as write_row2csv.
+    # parallel workers return their rows to the process owning the sink, which is the single writer
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.files = {}  # filename -> (file, csv writer)
+        self.rows = {}  # filename -> rows not written yet
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def write_row(self, filename: str, data: list) -> None:
+        with self.lock:
+            self.rows.setdefault(filename, []).append(data)
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        for filename, rows in self.rows.items():
+            if filename not in self.files:
+                f = open(filename, 'a', newline='')
+                self.files[filename] = (f, csv.writer(f))
+            f, writer = self.files[filename]
+            writer.writerows(rows)
+            f.flush()
+        self.rows = {}
+        self.pending = 0
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self._flush()
+            for f, _ in self.files.values():
+                f.close()
+            self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_tasks(func, tasks, jobs=1, chunksize=None):
+    # yield func(task) in the order of tasks, spread over a process pool when jobs > 1
+    # chunksize: tasks handed to a worker at once, 1 keeps tasks sorted by cost balanced
+    if jobs <= 1:
+        yield from map(func, tasks)
+        return
+    with ProcessPoolExecutor(jobs) as executor:
+        yield from executor.map(func, tasks, chunksize=chunksize or max(1, len(tasks) // (jobs * 16)))
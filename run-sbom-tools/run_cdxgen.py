@@ -4,12 +4,15 @@
 # docker run --rm -v $(outputDir):/tmp -v $(pwd):/app:rw -t ghcr.io/cyclonedx/cdxgen -r /app -o /tmp/cdx#cdxgen#$(packageName).json
 
 # this file is run in the origin environment to use docker.
+# python run_cdxgen.py --server: keep warm cdxgen containers in server mode and send them the repos as requests
+# instead of starting a container per repo.
 import os
-import time
-from util import read_directories, run_command_with_timeout, get_filename, write_to_file
+import sys
 
+from util import Job, WorkerPool, container_rss_mb, read_directories, get_filename, run_jobs
 
-def run():
+
+def run(server=False):
     # all paths
     root_path = '/path/to/sbom-measure'
     outputdir = f'{root_path}/sboms/results-python-cdxgen-v10.10.4/'
@@ -18,6 +21,7 @@ def run():
 
     cdxlogFile = f'{root_path}/logs/generate-sboms-logs/run_cdxgen_cdx_python_log-v10.10.4.txt'
     cmd_log_path = f'{root_path}/logs/generate-sboms-logs/run_cdxgen-python-v10.10.4.log'
+    usage_log = f'{root_path}/logs/generate-sboms-logs/run_cdxgen_usage_python-v10.10.4.jsonl'
 
     directories = read_directories(txt_path)
 
@@ -27,21 +31,33 @@ def run():
     packageName=cdxruntest
     docker run --rm -v $outputDir:/tmp -v $pwd:/app:rw -t ghcr.io/cyclonedx/cdxgen -r /app -o /tmp/cdx#cdxgen#$packageName.json
     '''
+    # server mode: the workers see all repos under /app, a request names the repo's path in there
+    repos_root = os.path.commonpath(directories) if server else None
+
+    jobs = []
     for directory in directories:
 
         fileName = get_filename(directory)
         outfile_name = f"cdx#cdxgen#{fileName}.json"
-        already = f"{outputdir}{outfile_name}"
-        if os.path.exists(already):
-            print(f"File {already} already exists.")
+        outfile = f"{outputdir}{outfile_name}"
+        if server:
+            request = {"path": f"/app/{os.path.relpath(directory, repos_root)}", "multiProject": True}
+            jobs.append(Job("cdxgen", fileName, [], [outfile], cdxlogFile, capture=outfile, skip_done=True,
+                            version="10.10.4", request=request))
             continue
         cmd = f"docker run --rm -v {outputdir}:/tmp -v {directory}:/app:rw -t ghcr.io/cyclonedx/cdxgen:v10.10.4 -r /app -o /tmp/{outfile_name}"
+        jobs.append(Job("cdxgen", fileName, cmd, [outfile], cdxlogFile, skip_done=True, version="10.10.4"))
+
+    if server:
+        start_cmd = (f"docker run --rm --name {{name}} -p 127.0.0.1:{{port}}:9090 -v {repos_root}:/app:rw "
+                     f"ghcr.io/cyclonedx/cdxgen:v10.10.4 --server --server-host 0.0.0.0 --server-port 9090")
+        pool = WorkerPool("cdxgen", start_cmd, cmd_log_path, size=2, stop_cmd="docker stop {name}",
+                          max_jobs=50, max_rss_mb=4096, rss_mb=container_rss_mb)
+        pool.run(jobs, usage_log=usage_log)
+        return
 
-        start_time = time.time()
-        run_command_with_timeout(cmd, 600, cmd_log_path)
-        end_time = time.time()
-        elapsed_time = int(end_time - start_time)
-        write_to_file("cdxgen", fileName, str(elapsed_time), cdxlogFile)
+    # the rusage covers the docker client only, the container runs under the docker daemon
+    run_jobs(jobs, cmd_log_path, usage_log=usage_log)
 
 
-run()
+run(server='--server' in sys.argv)
@@ -1,7 +1,4 @@
-import os
-import time
-
-from util import read_directories, run_command_with_timeout, get_filename, write_to_file
+from util import Job, read_directories, run_command_with_timeout, get_filename, run_jobs, tool_version, write_to_file
 
 
 def read_dir_run():
@@ -10,49 +7,35 @@ def read_dir_run():
     cmd_log_path = f'{root_path}/logs/generate-sboms-logs/gh-sbom-run-c-cpp.log'
     spdxlogFile = f'{root_path}/logs/generate-sboms-logs/gh-sbom_spdx_c-cpp_Log.txt'
     cdxlogFile = f'{root_path}/logs/generate-sboms-logs/gh-sbom_cdx_c-cpp_Log.txt'
+    usage_log = f'{root_path}/logs/generate-sboms-logs/gh-sbom_usage_c-cpp.jsonl'
+    version = tool_version('gh extension list | grep sbom')
 
     write_to_file('TOOL', 'Package', 'TIME', spdxlogFile)
     write_to_file('TOOL', 'Package', 'TIME', cdxlogFile)
 
     directories = read_directories(f'{root_path}/metadata-files/docker-fullpath-c-cpp.txt')
 
+    jobs = []
     for directory in directories:
 
-        # git add the dir or we will get error
+        # git add the dir or we will get error; one at a time, concurrent writers of the global config fail on its lock
         cmd1 = f"git config --global --add safe.directory {directory}"
         run_command_with_timeout(cmd1, 5, cmd_log_path)
         fileName = get_filename(directory)
         cdxout = outputdir + f"cdx#gh-sbom#{fileName}.json"
         spdxout = outputdir + f"spdx#gh-sbom#{fileName}.json"
 
-        cmd2 = f"cd {directory} && echo $(gh sbom | jq) > {spdxout}"
-        if os.path.exists(spdxout):
-            # if spedxout file exist but nothing in the file, we need to run the command again
-            if os.path.getsize(spdxout) == 1:
-                print(f"File {spdxout} exists but nothing in the file.")
-                pass
-            else:
-                print(f"File {spdxout} already exists.")
-                cmd2 = f"echo {spdxout} exists."
-        start_time = time.time()
-        run_command_with_timeout(cmd2, 600, cmd_log_path)
-        end_time = time.time()
-        elapsed_time = int(end_time - start_time)
-        write_to_file("gh-sbom", fileName, str(elapsed_time), spdxlogFile)
-
-        cmd3 = f"cd {directory} && echo $(gh sbom -c -l | jq) > {cdxout}"
-        if os.path.exists(cdxout):
-            if os.path.getsize(cdxout) == 1:
-                print(f"File {cdxout} exists but nothing in the file.")
-                pass
-            else:
-                print(f"File {cdxout} already exists.")
-                cmd3 = f"echo {cdxout} exists."
-        start_time = time.time()
-        run_command_with_timeout(cmd3, 600, cmd_log_path)
-        end_time = time.time()
-        elapsed_time = int(end_time - start_time)
-        write_to_file("gh-sbom", fileName, str(elapsed_time), cdxlogFile)
+        # gh sbom prints one format per call, its output is captured into the file as it is;
+        # an output holding only the newline of the former `echo $(...)` is run again
+        cmd2 = f"cd {directory} && gh sbom"
+        jobs.append(Job("gh-sbom", fileName, cmd2, [spdxout], spdxlogFile, capture=spdxout, skip_done=True,
+                        version=version))
+
+        cmd3 = f"cd {directory} && gh sbom -c -l"
+        jobs.append(Job("gh-sbom", fileName, cmd3, [cdxout], cdxlogFile, capture=cdxout, skip_done=True,
+                        version=version))
+
+    run_jobs(jobs, cmd_log_path, usage_log=usage_log)
 
 
 read_dir_run()
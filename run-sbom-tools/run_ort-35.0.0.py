@@ -1,6 +1,6 @@
 import os
 
-from util import read_directories, run_command_with_timeout, get_filename
+from util import Job, Stage, read_directories, get_filename, run_pipeline, tool_version
 
 
 def read_dir_run():
@@ -12,6 +12,9 @@ def read_dir_run():
     cmd_log_path = f'{root_path}/logs/generate-sboms-logs/ort-35.0.0-run-c-cpp.log'
 
     ort_tool_path = '/all-sbom-tools/ort-35.0.0/ort/cli/build/install/ort/bin/ort'
+    usage_log = f'{root_path}/logs/generate-sboms-logs/ort-35.0.0-usage-c-cpp.jsonl'
+    # the build under ort-35.0.0 reports its actual version
+    version = tool_version(f'{ort_tool_path} --version')
 
     if not os.path.exists(outputdir):
         os.makedirs(outputdir)
@@ -29,23 +32,25 @@ def read_dir_run():
 
     directories = read_directories(txt_path)
 
-    for directory in directories:
+    # analyze resolves dependencies over the network, scan keeps the cores busy, report is short:
+    # the three run as a pipeline over the repos, a stage whose result is there already is skipped
+    def analyze(directory):
         fileName = get_filename(directory)
-
         cmd1 = f'{ort_tool_path} -P ort.analyzer.allowDynamicVersions=true analyze -i {directory} -o {analyze_tmp_dir}{fileName}'
-        run_command_with_timeout(cmd1, 600, cmd_log_path)
-        print(f'{fileName} ort analyzer finished.')
+        analyzed_result = f'{analyze_tmp_dir}{fileName}/analyzer-result.yml'
+        return Job('ort-analyze', fileName, cmd1, [analyzed_result], skip_done=True, version=version)
 
+    def scan(directory):
+        fileName = get_filename(directory)
         analyzed_result = f'{analyze_tmp_dir}{fileName}/analyzer-result.yml'
         cmd2 = f'{ort_tool_path} scan -i {analyzed_result} -o {scan_tmp_dir}{fileName}'
-        run_command_with_timeout(cmd2, 600, cmd_log_path)
-        print(f'{fileName} ort scanner finished.')
+        scanned_result = f'{scan_tmp_dir}{fileName}/scan-result.yml'
+        return Job('ort-scan', fileName, cmd2, [scanned_result], skip_done=True, version=version)
 
-        # report
+    def report(directory):
+        fileName = get_filename(directory)
         scanned_result = f'{scan_tmp_dir}{fileName}/scan-result.yml'
         cmd3 = f'{ort_tool_path} report -i {scanned_result} -o {report_tmp_dir}{fileName} -f SpdxDocument,CycloneDx'
-        run_command_with_timeout(cmd3, 600, cmd_log_path)
-        print(f'{fileName} ort reporter finished.\n')
 
         cdx_report = f'{report_tmp_dir}{fileName}/bom.cyclonedx.xml'
         file_cdx = outputdir + 'cdx#ort#' + fileName + '.xml'
@@ -55,8 +60,11 @@ def read_dir_run():
         file_spdx = outputdir + 'spdx#ort#' + fileName + '.yml'
         cp_spdx = f'cp {spdx_report} {file_spdx}'
 
-        run_command_with_timeout(cp_cdx, 5)
-        run_command_with_timeout(cp_spdx, 5)
+        return Job('ort-report', fileName, cmd3, [file_cdx, file_spdx], skip_done=True, after=[cp_cdx, cp_spdx],
+                   version=version)
+
+    stages = [Stage('analyze', analyze, limit=2), Stage('scan', scan, limit=1), Stage('report', report, limit=1)]
+    run_pipeline(directories, stages, cmd_log_path, usage_log=usage_log)
 
 
 read_dir_run()
@@ -1,6 +1,4 @@
-import time
-
-from util import delete_directory, read_directories, run_command_with_timeout, get_filename, write_to_file
+from util import Job, delete_directory, read_directories, get_filename, run_jobs, tool_version
 
 
 def run():
@@ -11,28 +9,27 @@ def run():
 
     spdxlogFile = f'{root_path}/logs/generate-sboms-logs/sbom-tool-spdx-log-java.txt'
     cmd_log_path = f'{root_path}/logs/generate-sboms-logs/sbom-tool-run-java.log'
+    usage_log = f'{root_path}/logs/generate-sboms-logs/sbom-tool-usage-java.jsonl'
+    version = tool_version('sbom-tool version')
 
     directories = read_directories(txt_path)
+    jobs = []
     for directory in directories:
 
         fileName = get_filename(directory)
         spdxout = outputdir + f"spdx#sbom-tool#{fileName}.json"
+        # a manifest dir per repo, concurrent jobs would overwrite each other's `_manifest`
+        manifestDir = f"{tmpDir}{fileName}/"
 
         cmd1 = "sbom-tool generate -b %s -bc %s -ps %s -pm true -li true -m %s -pn %s -pv %s-15.4.6"
-        cmd1 = cmd1 % (directory, directory, fileName, tmpDir, fileName, fileName)
-
-        start_time = time.time()
-        run_command_with_timeout(cmd1, 600, cmd_log_path)
-        end_time = time.time()
+        cmd1 = cmd1 % (directory, directory, fileName, manifestDir, fileName, fileName)
 
-        elapsed_time = int(end_time - start_time)
-        write_to_file(fileName, str(elapsed_time), spdxlogFile)
+        cmd2 = f'mv {manifestDir}_manifest/spdx_2.2/manifest.spdx.json {outputdir}"spdx#sbom-tool#"{fileName}".json"'
+        # move the manifest out, then delete the `_manifest` dir
+        jobs.append(Job("sbom-tool", fileName, [f"mkdir -p {manifestDir}", cmd1], [spdxout], spdxlogFile,
+                        after=[cmd2, lambda manifestDir=manifestDir: delete_directory(manifestDir)], version=version))
 
-        # run_command_with_timeout(cmd, 5, cmd_log_path)
-        cmd2 = f'mv {tmpDir}_manifest/spdx_2.2/manifest.spdx.json {outputdir}"spdx#sbom-tool#"{fileName}".json"'
-        run_command_with_timeout(cmd2, 5, cmd_log_path)
-        # delete the `_manifest` dir
-        delete_directory(f"{tmpDir}_manifest")
+    run_jobs(jobs, cmd_log_path, usage_log=usage_log)
 
 
 run()
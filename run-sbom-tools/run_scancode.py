@@ -1,7 +1,4 @@
-import os
-import time
-
-from util import read_directories, run_command_with_timeout, get_filename, write_to_file
+from util import Job, read_directories, get_filename, run_jobs, tool_version, write_to_file
 
 
 def read_dir_run():
@@ -10,28 +7,22 @@ def read_dir_run():
     outputdir = f'{root_path}/sboms/results-java/'
     spdxlogFile = f'{root_path}/logs/generate-sboms-logs/scancode_cdx_java_log.txt'
     cmd_log_path = f'{root_path}/logs/generate-sboms-logs/scancode_run_java.log'
+    usage_log = f'{root_path}/logs/generate-sboms-logs/scancode_usage_java.jsonl'
+    version = tool_version('scancode --version')
 
-    write_to_file('Package', 'TIME', spdxlogFile)
+    write_to_file('TOOL', 'Package', 'TIME', spdxlogFile)
 
     directories = read_directories(txt_path)
 
+    jobs = []
     for directory in directories:
         cmd = "scancode -clpieu --cyclonedx  %scdx#scancode#%s.json %s"
         fileName = get_filename(directory)
-        already = f'{outputdir}cdx#scancode#{fileName}.json'
-        if os.path.exists(already):
-            print(f"File {already} already exists.")
-            continue
         cmd = cmd % (outputdir, fileName, directory)
+        jobs.append(Job("scancode", fileName, cmd, [f'{outputdir}cdx#scancode#{fileName}.json'], spdxlogFile, skip_done=True,
+                        version=version))
 
-        start_time = time.time()
-        run_command_with_timeout(cmd, 600, cmd_log_path)
-        end_time = time.time()
-
-        elapsed_time = int(end_time - start_time)
-        write_to_file(fileName, str(elapsed_time), spdxlogFile)
-
-        print(f"Finished scanning {fileName}")
+    run_jobs(jobs, cmd_log_path, usage_log=usage_log)
 
 
 read_dir_run()
@@ -1,6 +1,4 @@
-import time
-
-from util import read_directories, run_command_with_timeout, get_filename, write_to_file
+from util import Job, read_directories, get_filename, run_jobs, tool_version
 
 
 def run():
@@ -11,29 +9,23 @@ def run():
     spdxlogFile = f'{root_path}/logs/generate-sboms-logs/syft_spdx_python_log.txt'
     cdxlogFile = f'{root_path}/logs/generate-sboms-logs/syft_cdx_python_log.txt'
     cmd_log_path = f'{root_path}/logs/generate-sboms-logs/run_syft-python.log'
+    usage_log = f'{root_path}/logs/generate-sboms-logs/syft_usage_python.jsonl'
+    version = tool_version('syft version')
 
     directories = read_directories(txt_path)
 
+    jobs = []
     for directory in directories:
 
         fileName = get_filename(directory)
         cdxout = outputdir + f"cdx#syft#{fileName}.json"
         spdxout = outputdir + f"spdx#syft#{fileName}.json"
 
-        cmd = f"syft {directory} -o spdx-json={spdxout}"
-        start_time = time.time()
-        run_command_with_timeout(cmd, 600, cmd_log_path)
-
-        end_time = time.time()
-        elapsed_time = int(end_time - start_time)
-        write_to_file(fileName, str(elapsed_time), spdxlogFile)
+        # one catalog of the repo written in both formats, the time goes to both logs
+        cmd = f"syft {directory} -o spdx-json={spdxout} -o cyclonedx-json={cdxout}"
+        jobs.append(Job("syft", fileName, cmd, [spdxout, cdxout], [spdxlogFile, cdxlogFile], version=version))
 
-        cmd = f"syft {directory} -o cyclonedx-json={cdxout}"
-        start_time = time.time()
-        run_command_with_timeout(cmd, 600, cmd_log_path)
-        end_time = time.time()
-        elapsed_time = int(end_time - start_time)
-        write_to_file(fileName, str(elapsed_time), cdxlogFile)
+    run_jobs(jobs, cmd_log_path, usage_log=usage_log)
 
 
 run()
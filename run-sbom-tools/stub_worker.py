@@ -0,0 +1,58 @@
+# a stand-in for a tool in server mode (cdxgen --server) to try WorkerPool without the tool:
+# GET /health answers {"status": "OK"}, POST /sbom with {"path": ...} answers a CycloneDX document
+# with one component per file under path.
+#   python stub_worker.py --port 9090 --startup 2 --delay 0.5 --leak-mb 20
+import argparse
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+leaked = []
+
+
+def stub_sbom(path):
+    components = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            components.append({'type': 'file', 'name': os.path.relpath(os.path.join(root, name), path), 'version': '0'})
+    return {'bomFormat': 'CycloneDX', 'specVersion': '1.5', 'version': 1,
+            'metadata': {'tools': [{'name': 'stub-worker'}], 'component': {'name': os.path.basename(path.rstrip('/'))}},
+            'components': components}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.reply(200, {'status': 'OK'})
+        else:
+            self.reply(404, {'error': self.path})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path != '/sbom' or not os.path.isdir(request.get('path', '')):
+            self.reply(500, {'error': f'no such path: {request.get("path")}'})
+            return
+        time.sleep(args.delay)
+        # memory the tool keeps between requests, for the recycling of WorkerPool
+        leaked.append(bytearray(int(args.leak_mb * 1024 ** 2)))
+        self.reply(200, stub_sbom(request['path']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=9090)
+    parser.add_argument('--startup', type=float, default=0, help='seconds before it listens, as a JVM or container start')
+    parser.add_argument('--delay', type=float, default=0, help='seconds per request')
+    parser.add_argument('--leak-mb', type=float, default=0, help='memory kept per request')
+    args = parser.parse_args()
+    time.sleep(args.startup)
+    HTTPServer(('127.0.0.1', args.port), Handler).serve_forever()
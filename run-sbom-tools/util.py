@@ -1,6 +1,17 @@
+import json
 import os
+import queue
+import re
+import selectors
 import shutil
+import signal
 import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 
 def read_directories(txt_path):
@@ -14,21 +25,146 @@ def read_directories(txt_path):
         return directories
 
 
-def run_command_with_timeout(cmd, timeout_sec, cmd_log_path):
+# one writer at a time for the logs shared by the jobs of run_jobs
+log_lock = threading.Lock()
+
+
+# bytes of STDOUT and of STDERR of one command kept in the command log, the rest is counted and dropped
+LOG_CAP = 1 << 20
+# seconds between SIGTERM and SIGKILL of a timed-out command
+KILL_GRACE = 10
+# the pid and stream that wrote last to a command log, a change of writer starts a new labelled section
+last_writer = {}
+
+
+class CommandResult:
+    # returncode: exit status of the shell, negative for a signal, None when the command could not start
+    # timed_out:  the command hit its timeout and its process group was stopped
+    # duration:   wall seconds until the command and its output were done
+    # usage:      the rusage of wait4 on the shell: its own and that of every descendant it waited for,
+    #             so the whole tool; None when the command could not start
+    def __init__(self, cmd, returncode, timed_out, duration, dropped=0, usage=None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self.duration = duration
+        self.dropped = dropped
+        self.usage = usage
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.timed_out
+
+
+def write_log(cmd_log_path, pid, name, data):
+    # append to a log that the commands of several jobs share
+    with log_lock, open(cmd_log_path, 'a') as f:
+        if last_writer.get(cmd_log_path) != (pid, name):
+            f.write(f"\n[{pid}] {name}:\n")
+            last_writer[cmd_log_path] = (pid, name)
+        f.write(data)
+
+
+def reap(proc, timeout_sec=None):
+    # wait4 the shell of proc, which keeps the rusage that Popen.wait would discard; True once it is reaped.
+    # timeout_sec None: block until it exits
+    deadline = None if timeout_sec is None else time.time() + timeout_sec
+    while proc.returncode is None:
+        pid, status, usage = os.wait4(proc.pid, 0 if deadline is None else os.WNOHANG)
+        if pid:
+            proc.returncode, proc.rusage = os.waitstatus_to_exitcode(status), usage
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def stop_group(proc, grace_sec=None):
+    # SIGTERM to the whole process group of proc (docker run passes it on to the container, the JVM shuts down),
+    # SIGKILL to what is left after grace_sec, by default KILL_GRACE
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            return
+        deadline = time.time() + (grace_sec if grace_sec is not None else KILL_GRACE)
+        while time.time() < deadline:
+            reap(proc, 0)
+            try:
+                os.killpg(proc.pid, 0)
+            except ProcessLookupError:
+                return
+            time.sleep(0.1)
+
+
+def run_command_with_timeout(cmd, timeout_sec, cmd_log_path, stdout_path=None, log_cap=LOG_CAP):
+    # run cmd in a session of its own, so that a timeout stops the tool and every process it started, not only the
+    # shell. STDOUT and STDERR go to the log as they come, log_cap bytes of each at most.
+    # stdout_path: the command prints the SBOM, its standard output goes to that file instead of the log,
+    # which is written aside and renamed into place only when the command succeeded with some output
+    start_time = time.time()
     try:
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, timeout=timeout_sec)
-        stdout, stderr = result.stdout.decode('utf-8'), result.stderr.decode('utf-8')
-    except subprocess.TimeoutExpired as e:
-        stdout, stderr = None, f'Command \"{cmd}\" timed out after {timeout_sec} seconds'.encode('utf-8').decode('utf-8')
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, start_new_session=True)
     except Exception as e:
-        stdout, stderr = None, str(e)
+        write_log(cmd_log_path, None, 'STDERR', f"{cmd}\n{e}\n")
+        return CommandResult(cmd, None, False, time.time() - start_time)
+    write_log(cmd_log_path, proc.pid, 'CMD', f"{cmd}\n")
 
-    with open(cmd_log_path, 'a') as f:
-        f.write(f"\n{cmd}")
-        if stdout:
-            f.write("\nSTDOUT:\n" + stdout)
-        if stderr:
-            f.write("\nSTDERR:\n" + stderr)
+    out_file = open(stdout_path + '.tmp', 'wb') if stdout_path is not None else None
+    names = {proc.stdout.fileno(): 'STDOUT', proc.stderr.fileno(): 'STDERR'}
+    kept, dropped = {'STDOUT': 0, 'STDERR': 0}, 0
+    selector = selectors.DefaultSelector()
+    for pipe in [proc.stdout, proc.stderr]:
+        selector.register(pipe, selectors.EVENT_READ)
+    deadline, timed_out = start_time + timeout_sec, False
+    while selector.get_map():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            if timed_out:  # a process outside the group still holds the pipes
+                break
+            timed_out = True
+            stop_group(proc)
+            deadline = time.time() + KILL_GRACE  # for the rest of the output
+            continue
+        for key, _ in selector.select(timeout=remaining):
+            chunk = os.read(key.fd, 1 << 16)
+            if not chunk:
+                selector.unregister(key.fileobj)
+                continue
+            name = names[key.fd]
+            if name == 'STDOUT' and out_file is not None:
+                out_file.write(chunk)
+                continue
+            keep = chunk[:max(0, log_cap - kept[name])]
+            kept[name] += len(keep)
+            dropped += len(chunk) - len(keep)
+            if keep:
+                write_log(cmd_log_path, proc.pid, name, keep.decode('utf-8', 'replace'))
+    selector.close()
+    proc.stdout.close()
+    proc.stderr.close()
+    if not reap(proc, max(0., deadline - time.time()) if not timed_out else KILL_GRACE):
+        timed_out = True
+        stop_group(proc)
+        reap(proc)
+    result = CommandResult(cmd, proc.returncode, timed_out, time.time() - start_time, dropped, getattr(proc, 'rusage', None))
+
+    if out_file is not None:
+        size = out_file.tell()
+        out_file.close()
+        if result.ok and size > 1:
+            os.replace(stdout_path + '.tmp', stdout_path)
+            write_log(cmd_log_path, proc.pid, 'STDOUT', f"{size} bytes written to {stdout_path}\n")
+        else:
+            os.remove(stdout_path + '.tmp')
+    notes = [f"exit {result.returncode}", f"{result.duration:.1f}s"]
+    if timed_out:
+        notes.append(f"timed out after {timeout_sec} seconds, process group stopped")
+    if dropped:
+        notes.append(f"{dropped} bytes of output over the log cap dropped")
+    write_log(cmd_log_path, proc.pid, 'RESULT', ', '.join(notes) + "\n")
+    return result
 
 
 def delete_directory(path):
@@ -43,11 +179,431 @@ def get_filename(path):
     return os.path.basename(path)
 
 
-def write_to_file(package, time, filename):
-    with open(filename, 'a') as f:
-        f.write("{:<10}  {:<10}\n".format(package, time))
-
-
 def write_to_file(tool, package, time, filename):
     with open(filename, 'a') as f:
         f.write("{:<10} {:<20} {:<10}\n".format(tool, package, time))
+
+
+# (tool, repo) jobs that may run at the same time per tool: ORT and scancode keep all cores busy for one repo,
+# cdxgen starts a container, gh-sbom mostly waits on the GitHub API. Tools not listed run one at a time
+TOOL_LIMITS = {'ort': 1, 'scancode': 2, 'cdxgen': 2, 'sbom-tool': 4, 'syft': 4, 'gh-sbom': 8}
+
+
+class Job:
+    # one run of a tool on a repo:
+    #   cmds:      shell commands run one after another, timed together; a command is a string or (cmd, timeout_sec)
+    #   outputs:   the SBOM files the job writes, e.g. {outputdir}cdx#syft#{repo}.json; one run of a tool
+    #              that emits several formats at once writes all of them
+    #   time_log:  timing log, or one per output format; the elapsed seconds are appended to each
+    #              as write_to_file(tool, repo, seconds, time_log)
+    #   capture:   output file the standard output of the last command is written to, for tools that print the SBOM
+    #   skip_done: skip the job when all outputs exist and hold more than the lone newline of a failed run
+    #   after:     untimed clean-up once the commands are done, shell commands or callables
+    #   version:   version of the tool, for the usage log
+    #   request:   JSON body of the request to a WorkerPool, which runs the job instead of cmds; the response
+    #              is written to capture
+    def __init__(self, tool, repo, cmds, outputs=(), time_log=None, timeout=600, capture=None, skip_done=False, after=(),
+                 version=None, request=None):
+        self.tool = tool
+        self.version = version
+        self.timeout = timeout
+        self.request = request
+        self.repo = repo
+        self.cmds = [cmd if isinstance(cmd, tuple) else (cmd, timeout) for cmd in ([cmds] if isinstance(cmds, str) else cmds)]
+        self.outputs = list(outputs)
+        self.time_logs = [time_log] if isinstance(time_log, str) else list(time_log or [])
+        self.capture = capture
+        self.skip_done = skip_done
+        self.after = [after] if isinstance(after, str) or callable(after) else list(after)
+
+    def done(self):
+        return bool(self.outputs) and all(os.path.exists(out) and os.path.getsize(out) > 1 for out in self.outputs)
+
+
+def run_job(job, cmd_log_path, usage_log=None):
+    # elapsed seconds and the CommandResult of each command; usage_log: JSON-lines file the usage_record is appended to
+    start_time = time.time()
+    results = [run_command_with_timeout(cmd, timeout_sec, cmd_log_path, job.capture if i == len(job.cmds) - 1 else None)
+               for i, (cmd, timeout_sec) in enumerate(job.cmds)]
+    wall_time = time.time() - start_time
+    elapsed_time = int(wall_time)
+    for step in job.after:
+        if callable(step):
+            step()
+        else:
+            run_command_with_timeout(step, 60, cmd_log_path)
+    with log_lock:
+        for time_log in job.time_logs:
+            write_to_file(job.tool, job.repo, str(elapsed_time), time_log)
+        if usage_log:
+            with open(usage_log, 'a') as f:
+                f.write(json.dumps(usage_record(job, start_time, wall_time, results)) + '\n')
+    return elapsed_time, results
+
+
+def available_memory_mb():
+    # MemAvailable of /proc/meminfo, None where there is none
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def admit(max_load, min_memory_mb):
+    # room for one more job: the 1-minute load average is below max_load and min_memory_mb MB are available
+    if os.getloadavg()[0] >= max_load:
+        return False
+    memory = available_memory_mb()
+    return memory is None or memory >= min_memory_mb
+
+
+def run_jobs(jobs, cmd_log_path, tool_limits=TOOL_LIMITS, max_workers=None, max_load=None, min_memory_mb=2048, poll=5,
+             usage_log=None):
+    # run the jobs concurrently in their order, at most tool_limits[tool] of a tool and max_workers in all
+    # (default: the CPU count). A job only starts while admit(max_load, min_memory_mb) holds, max_load defaults
+    # to the CPU count; with nothing running the next job always starts, so a busy machine slows the run but never stalls it.
+    # usage_log: JSON-lines file of the resources used per job, see usage_record and `python util.py summary`.
+    # returns (job, elapsed seconds, CommandResults) per job that ran, (job, None, []) for a job that raised
+    max_workers = max_workers or os.cpu_count() or 1
+    max_load = max_load or os.cpu_count() or 1
+    pending = []
+    for job in jobs:
+        if job.skip_done and job.done():
+            print(f"{job.tool} {job.repo}: {', '.join(job.outputs)} already exists.")
+            continue
+        pending.append(job)
+    total, results = len(pending), []
+    running, per_tool = {}, Counter()
+    with ThreadPoolExecutor(max_workers) as executor:
+        while pending or running:
+            if pending and len(running) < max_workers and (not running or admit(max_load, min_memory_mb)):
+                # the first pending job whose tool is under its limit, later jobs of other tools may overtake
+                job = next((job for job in pending if per_tool[job.tool] < max(1, tool_limits.get(job.tool, 1))), None)
+                if job is not None:
+                    pending.remove(job)
+                    per_tool[job.tool] += 1
+                    running[executor.submit(run_job, job, cmd_log_path, usage_log)] = job
+                    continue
+            finished, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                per_tool[job.tool] -= 1
+                try:
+                    elapsed_time, cmd_results = future.result()
+                    failed = [r for r in cmd_results if not r.ok]
+                    state = f"finished in {elapsed_time}s" if not failed else \
+                        'failed: ' + '; '.join('timed out' if r.timed_out else f'exit {r.returncode}' for r in failed)
+                    print(f"[{len(results) + 1}/{total}] {job.tool} {job.repo} {state}.")
+                except Exception as e:
+                    elapsed_time, cmd_results = None, []
+                    print(f"[{len(results) + 1}/{total}] {job.tool} {job.repo} failed: {e}")
+                results.append((job, elapsed_time, cmd_results))
+    return results
+
+
+class Stage:
+    # one step of run_pipeline: job(item) builds the Job of an item (e.g. a repo directory), limit of them run at once.
+    # A Job with skip_done whose outputs exist is not run again; an item whose Job leaves an output missing
+    # (or, without outputs, a command failing) does not go on to the later stages
+    def __init__(self, name, job, limit=1):
+        self.name = name
+        self.job = job
+        self.limit = limit
+
+
+def run_pipeline(items, stages, cmd_log_path, queue_size=2, usage_log=None):
+    # run each item through the stages in order, the stages of different items at the same time: item N+1 is in the
+    # first stage while item N is in the second. Between two stages a queue of at most queue_size items,
+    # so that a fast stage waits for a slow one rather than piling up finished work.
+    # returns stage name -> {repo: 'done' | 'skipped' | 'failed'}
+    queues = [queue.Queue(queue_size) for _ in stages] + [None]
+    states = {stage.name: {} for stage in stages}
+    workers_left = [stage.limit for stage in stages]
+    lock = threading.Lock()
+
+    def work(i):
+        stage = stages[i]
+        try:
+            while True:
+                item = queues[i].get()
+                if item is None:
+                    break
+                # an item whose Job cannot be built is known by the item itself
+                repo = item
+                try:
+                    job = stage.job(item)
+                    repo = job.repo
+                    if job.skip_done and job.done():
+                        state = 'skipped'
+                    else:
+                        elapsed_time, results = run_job(job, cmd_log_path, usage_log)
+                        ok = job.done() if job.outputs else all(r.ok for r in results)
+                        state = 'done' if ok else 'failed'
+                        print(f"[{stage.name}] {repo} {state} in {elapsed_time}s.")
+                except Exception as e:
+                    state = 'failed'
+                    print(f"[{stage.name}] {repo} failed: {e}")
+                states[stage.name][repo] = state
+                if state != 'failed' and queues[i + 1] is not None:
+                    queues[i + 1].put(item)
+        finally:
+            # the last worker of a stage stops those of the next one, also when this one died
+            with lock:
+                workers_left[i] -= 1
+                last = workers_left[i] == 0
+            if last and queues[i + 1] is not None:
+                for _ in range(stages[i + 1].limit):
+                    queues[i + 1].put(None)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i, stage in enumerate(stages) for _ in range(stage.limit)]
+    for thread in threads:
+        thread.start()
+    for item in items:
+        queues[0].put(item)
+    for _ in range(stages[0].limit):
+        queues[0].put(None)
+    for thread in threads:
+        thread.join()
+    return states
+
+
+class ToolWorker:
+    # one long-lived tool process that serves HTTP on port, e.g. cdxgen --server in its container.
+    # start_cmd and stop_cmd may use {port} and {name}; stop_cmd (e.g. docker stop {name}) stops what lives outside
+    # the process group, such as the container. The output of the process goes to {cmd_log_path}.{name}
+    def __init__(self, name, start_cmd, port, cmd_log_path, stop_cmd=None, health='/health', ready_timeout=120):
+        self.name = name
+        self.port = port
+        self.start_cmd = start_cmd.format(port=port, name=name)
+        self.stop_cmd = stop_cmd.format(port=port, name=name) if stop_cmd else None
+        self.cmd_log_path = cmd_log_path
+        self.health = health
+        self.ready_timeout = ready_timeout
+        self.proc = None
+        self.jobs = 0
+
+    def start(self):
+        with open(f"{self.cmd_log_path}.{self.name}", 'a') as log:
+            log.write(f"\n{self.start_cmd}\n")
+            log.flush()
+            self.proc = subprocess.Popen(self.start_cmd, stdout=log, stderr=log, shell=True, start_new_session=True)
+        self.jobs = 0
+        deadline = time.time() + self.ready_timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.proc.returncode} while starting")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}{self.health}", timeout=5):
+                    return
+            except OSError:
+                time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"{self.name} not ready after {self.ready_timeout} seconds")
+
+    def request(self, path, body, timeout_sec):
+        request = urllib.request.Request(f"http://127.0.0.1:{self.port}{path}", data=json.dumps(body).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        self.jobs += 1
+        with urllib.request.urlopen(request, timeout=timeout_sec) as response:
+            return response.read()
+
+    def rss_mb(self):
+        # resident memory of the processes of the worker's group, from /proc
+        total = 0
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            try:
+                if os.getpgid(int(pid)) != self.proc.pid:
+                    continue
+                with open(f'/proc/{pid}/status') as f:
+                    total += next((int(line.split()[1]) for line in f if line.startswith('VmRSS:')), 0)
+            except (OSError, ProcessLookupError):
+                continue
+        return total / 1024
+
+    def stop(self):
+        if self.stop_cmd:
+            subprocess.run(self.stop_cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if self.proc is not None:
+            stop_group(self.proc)
+            self.proc.wait()
+            self.proc = None
+
+
+def container_rss_mb(worker):
+    # memory of the container named after the worker, for a worker whose tool runs under the docker daemon
+    usage = subprocess.run(f'docker stats --no-stream --format "{{{{.MemUsage}}}}" {worker.name}', shell=True,
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode('utf-8')
+    value = re.match(r'\s*([\d.]+)\s*([KMG]i?B)', usage)
+    if value is None:
+        return 0
+    return float(value.group(1)) * {'K': 1 / 1024, 'M': 1, 'G': 1024}[value.group(2)[0]]
+
+
+class WorkerPool:
+    # size warm ToolWorkers fed the jobs as requests (POST of job.request to endpoint), so that many small repos do not
+    # each pay the start of a container or a JVM. A worker is recycled after max_jobs requests, once its memory grows
+    # over max_rss_mb (rss_mb: the measure, ToolWorker.rss_mb or container_rss_mb), or when a request fails.
+    # Worker i listens on base_port + i
+    def __init__(self, tool, start_cmd, cmd_log_path, size=2, base_port=9090, endpoint='/sbom', stop_cmd=None,
+                 max_jobs=50, max_rss_mb=None, rss_mb=None, health='/health', ready_timeout=120):
+        self.tool = tool
+        self.workers = [ToolWorker(f'{tool}-worker{base_port + i}', start_cmd, base_port + i, cmd_log_path, stop_cmd,
+                                   health, ready_timeout) for i in range(size)]
+        self.cmd_log_path = cmd_log_path
+        self.endpoint = endpoint
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.rss_mb = rss_mb or ToolWorker.rss_mb
+
+    def recycle(self, worker, reason):
+        print(f"{worker.name} recycled: {reason}.")
+        worker.stop()
+        worker.start()
+
+    def work(self, worker, jobs, results, usage_log):
+        try:
+            worker.start()
+            while True:
+                try:
+                    job = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                start_time = time.time()
+                recycle = None
+                try:
+                    response = worker.request(self.endpoint, job.request, job.timeout)
+                    if len(response) > 1:
+                        with open(job.capture + '.tmp', 'wb') as f:
+                            f.write(response)
+                        os.replace(job.capture + '.tmp', job.capture)
+                    # an empty answer fails as a tool printing nothing would, no capture is written
+                    result = CommandResult(job.request, 0 if len(response) > 1 else 1, False, time.time() - start_time)
+                except Exception as e:
+                    timed_out = 'timed out' in str(e)
+                    result = CommandResult(job.request, None, timed_out, time.time() - start_time)
+                    write_log(self.cmd_log_path, worker.name, 'STDERR', f"{json.dumps(job.request)}\n{e}\n")
+                    if not isinstance(e, urllib.error.HTTPError):  # an error answer leaves the worker fine
+                        recycle = f'{job.repo} failed: {e}'
+                elapsed_time = int(result.duration)
+                with log_lock:
+                    for time_log in job.time_logs:
+                        write_to_file(job.tool, job.repo, str(elapsed_time), time_log)
+                    if usage_log:
+                        # the tool runs in the worker, only the wall time of the request is known
+                        with open(usage_log, 'a') as f:
+                            f.write(json.dumps(usage_record(job, start_time, result.duration, [result])) + '\n')
+                state = f"finished in {elapsed_time}s" if result.ok and job.done() else "failed"
+                print(f"[{len(results) + 1}] {job.tool} {job.repo} {state} on {worker.name}.")
+                results.append((job, elapsed_time, [result]))
+                # recycled once the job is recorded, a worker that does not restart loses no result
+                if recycle is not None:
+                    self.recycle(worker, recycle)
+                elif result.ok and worker.jobs >= self.max_jobs:
+                    self.recycle(worker, f'{worker.jobs} jobs')
+                elif result.ok and self.max_rss_mb is not None and self.rss_mb(worker) > self.max_rss_mb:
+                    self.recycle(worker, f'over {self.max_rss_mb} MB')
+        except RuntimeError as e:
+            # the worker does not start, the others take over its jobs
+            print(f"{worker.name} stopped: {e}")
+        finally:
+            worker.stop()
+
+    def run(self, jobs, usage_log=None):
+        # returns (job, elapsed seconds, [CommandResult]) per job that ran, as run_jobs
+        pending = queue.Queue()
+        for job in jobs:
+            if job.skip_done and job.done():
+                print(f"{job.tool} {job.repo}: {', '.join(job.outputs)} already exists.")
+                continue
+            pending.put(job)
+        results = []
+        threads = [threading.Thread(target=self.work, args=(worker, pending, results, usage_log)) for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # jobs left when no worker would start
+        while not pending.empty():
+            job = pending.get_nowait()
+            print(f"[{len(results) + 1}] {job.tool} {job.repo} failed: no worker running.")
+            results.append((job, None, []))
+        return results
+
+
+def tool_version(cmd):
+    # the first version number that cmd (e.g. `scancode --version`) prints, None when it prints none
+    output = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.decode('utf-8', 'replace')
+    version = re.search(r'\d+(\.\d+)+', output)
+    return version.group(0) if version else None
+
+
+def usage_record(job, start_time, elapsed_time, results):
+    # one line of the usage log: the resources of all commands of the job, keyed by (tool, version, standard, repo);
+    # standard joins those of the outputs, e.g. spdx+cdx for one run that writes both.
+    # ru_maxrss is in KB, ru_inblock / ru_oublock count 512-byte blocks of the file system
+    usages = [r.usage for r in results if r.usage is not None]
+    standards = [os.path.basename(out).split('#')[0] for out in job.outputs if '#' in os.path.basename(out)]
+    return {
+        'tool': job.tool, 'version': job.version, 'standard': '+'.join(dict.fromkeys(standards)) or None,
+        'repo': job.repo, 'start': round(start_time, 3), 'wall': round(elapsed_time, 3),
+        'user': round(sum(u.ru_utime for u in usages), 3), 'sys': round(sum(u.ru_stime for u in usages), 3),
+        'max_rss': max([u.ru_maxrss * 1024 for u in usages], default=None),
+        'read_bytes': sum(u.ru_inblock for u in usages) * 512, 'written_bytes': sum(u.ru_oublock for u in usages) * 512,
+        'exit': [r.returncode for r in results], 'timed_out': any(r.timed_out for r in results)
+    }
+
+
+def percentile(values, p):
+    # nearest-rank percentile of the values, None of none
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, -(-p * len(values) // 100) - 1))]
+
+
+def summarize_usage(usage_logs, percentiles=(50, 90, 99)):
+    # per (tool, version, standard) of the usage logs: jobs, failures, throughput in repos per hour over the span
+    # from the first start to the last end, and the percentiles of wall, CPU, peak RSS and I/O per job
+    groups = {}
+    for usage_log in usage_logs:
+        with open(usage_log) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    groups.setdefault((record['tool'], record['version'], record['standard']), []).append(record)
+    rows = []
+    for (tool, version, standard), records in sorted(groups.items(), key=lambda item: [str(k) for k in item[0]]):
+        span = max(r['start'] + r['wall'] for r in records) - min(r['start'] for r in records)
+        row = {'tool': tool, 'version': version, 'standard': standard, 'jobs': len(records),
+               'failed': sum(r['timed_out'] or any(code != 0 for code in r['exit']) for r in records),
+               'repos_per_hour': round(len(records) * 3600 / span, 1) if span > 0 else None}
+        for name, values in [('wall_s', [r['wall'] for r in records]),
+                             ('cpu_s', [r['user'] + r['sys'] for r in records]),
+                             ('rss_mb', [r['max_rss'] / 1024 ** 2 if r['max_rss'] is not None else None for r in records]),
+                             ('io_mb', [(r['read_bytes'] + r['written_bytes']) / 1024 ** 2 for r in records])]:
+            for p in percentiles:
+                value = percentile(values, p)
+                row[f'{name}_p{p}'] = round(value, 1) if value is not None else None
+        rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    # python util.py summary <usage log>... : the per-tool summary of the usage logs as CSV
+    import argparse
+    import csv
+    import sys
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['summary'])
+    parser.add_argument('usage_logs', nargs='+')
+    args = parser.parse_args()
+    rows = summarize_usage(args.usage_logs)
+    if rows:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)